@@ -49,5 +49,18 @@ def remove_event_detect(channel):
     pass
 
 
-def PWM(*args, **kwargs):
-    pass
+class PWM:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def start(self, duty_cycle):
+        pass
+
+    def stop(self):
+        pass
+
+    def ChangeDutyCycle(self, duty_cycle):
+        pass
+
+    def ChangeFrequency(self, frequency):
+        pass
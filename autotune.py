@@ -0,0 +1,237 @@
+# Offline autotuner for the x and y controllers.
+# A simple model of each axis is fitted to recorded moves (see CAPTURE_CONTROLLER_DATA in globals.py), then the
+# controller gains, step frequency limits and error margin are searched on a simulation of the control loop
+# to minimise the mean move and settle time without overshooting too far. Run
+#     python autotune.py logs/<timestamp>_moves.json
+# to write the tuned profiles to AXIS_PROFILE_PATH, which initialise_io loads.
+# To record the moves with step experiments on the machine instead, for both or the given axes, run
+#     python autotune.py --experiment [x] [y]
+# which homes the axes, moves them back and forth over STEP_DISTANCES, stores the moves in logs/ and tunes on them.
+from collections import namedtuple
+from datetime import datetime
+import itertools
+import json
+import os
+import statistics
+import sys
+from pid_controller.pid import PID
+from backlash import estimate_backlash
+from axis_files import load_axis_settings, save_axis_settings, read_recorded_moves
+
+# Tuned controller settings per axis:
+# {"x": {"p_gain": ..., "i_gain": ..., "d_gain": ..., "frequency_limits": [min, max], "error_margin": ...}, "y": ...}
+AXIS_PROFILE_PATH = 'axis_profile.json'
+
+# mm_per_step: load displacement per motor step in mm
+# sample_period: time between caliper readings in s
+# backlash: (positive, negative) backlash in steps
+AxisModel = namedtuple('AxisModel', ['mm_per_step', 'sample_period', 'backlash'])
+
+# Search space of the tuner
+P_GAINS = [100, 200, 300, 400, 600, 800, 1200, 1600]
+I_GAINS = [0]
+D_GAINS = [0, 5, 20]
+MIN_FREQUENCIES = [5, 10, 20, 40, 80]
+MAX_FREQUENCIES = [400, 600, 800, 1000]
+ERROR_MARGINS = [0.05, 0.1]
+STEP_DISTANCES = [0.5, 2, 9, 26, 50]  # mm, well pitches and longer moves
+
+
+def fit_axis_model(moves):
+    """Fit an AxisModel to recorded moves.
+
+    Args:
+        moves: list of recorded moves, each a list of (time, position, step rate, reversed) samples
+               as stored in Controller.captured_data, the step rate is the rate the motor actually stepped at
+
+    Returns:
+        AxisModel
+    """
+    ratios = []
+    periods = []
+    for move in moves:
+        for (previous_time, previous_position, _, previous_direction), (sample_time, position, step_rate, direction) \
+                in zip(move, move[1:]):
+            periods.append(sample_time - previous_time)
+            steps = step_rate * (sample_time - previous_time)
+            displacement = position - previous_position if direction else previous_position - position
+            # Only use intervals well clear of a direction change, where no backlash is taken up
+            if direction == previous_direction and steps > 0 and displacement > 0.05:
+                ratios.append(displacement / steps)
+    if not ratios:
+        raise ValueError("Not enough recorded movement to fit a model")
+    backlash = estimate_backlash(moves)
+    return AxisModel(statistics.median(ratios), statistics.median(periods),
+                     (backlash['positive'] or 0, backlash['negative'] or 0))
+
+
+def simulate_move(model, distance, p_gain, i_gain, d_gain, frequency_limits, error_margin, settling_time,
+                  timeout=60):
+    """Simulate a single move of the control loop in Controller._control_loop on an axis model
+
+    Args:
+        model: AxisModel
+        distance: distance to move in mm, negative to move in the negative direction
+        p_gain, i_gain, d_gain: controller gains
+        frequency_limits: (minimum, maximum) step frequency
+        error_margin: allowed error in mm
+        settling_time: time in s the load has to stay within the error margin
+        timeout: simulated time in s after which the move counts as failed
+
+    Returns:
+        (move time in s or None if the move did not settle, maximum overshoot in mm)
+    """
+    step_frequency_min, step_frequency_max = frequency_limits
+    now = 0.0
+    pid = PID(p=p_gain, i=i_gain, d=d_gain, get_time=lambda: now)
+    position = 0.0
+    # Start in the opposite direction, so the first iteration changes direction and takes up the backlash
+    reversed_direction = distance < 0
+    frequency = 0
+    start_settling_time = None
+    overshoot = 0
+    while now < timeout:
+        # Move the load with the frequency commanded in the previous iteration
+        steps = frequency * model.sample_period
+        position += steps * model.mm_per_step * (1 if reversed_direction else -1)
+        now += model.sample_period
+        overshoot = max(overshoot, position - distance if distance >= 0 else distance - position)
+
+        # Caliper reading with 0.01 mm resolution
+        error = distance - round(position, 2)
+        if abs(error) < error_margin:
+            if start_settling_time is None:
+                start_settling_time = now
+            elif now - start_settling_time > settling_time:
+                return now, overshoot
+        else:
+            start_settling_time = None
+
+        output = pid(feedback=error, curr_tm=now)
+        if output > 0 and not reversed_direction or output <= 0 and reversed_direction:
+            reversed_direction = not reversed_direction
+            # The backlash is taken up by a burst of steps at the maximum frequency, the load does not move
+            now += model.backlash[0 if reversed_direction else 1] / step_frequency_max
+        if abs(output) > step_frequency_max:
+            frequency = step_frequency_max
+        elif abs(output) < step_frequency_min:
+            frequency = step_frequency_min
+        else:
+            frequency = abs(output)
+    return None, overshoot
+
+
+def tune_axis(model, settling_time, max_error_margin=0.1, max_overshoot=1.0, distances=STEP_DISTANCES):
+    """Search the controller settings with the lowest mean move time on an axis model
+
+    Args:
+        model: AxisModel
+        settling_time: settling time of the controller in s
+        max_error_margin: largest allowed error margin in mm
+        max_overshoot: largest allowed overshoot in mm, keeps the load clear of the limit switches
+        distances: move distances in mm to average the move time over, both directions are simulated
+
+    Returns:
+        (profile dict, mean move time in s) or (None, None) if no settings meet the constraints
+    """
+    best_profile, best_time = None, None
+    for p_gain, i_gain, d_gain, frequency_min, frequency_max, error_margin in itertools.product(
+            P_GAINS, I_GAINS, D_GAINS, MIN_FREQUENCIES, MAX_FREQUENCIES, ERROR_MARGINS):
+        if error_margin > max_error_margin:
+            continue
+        total_time = 0
+        for distance in itertools.chain(distances, (-distance for distance in distances)):
+            move_time, overshoot = simulate_move(model, distance, p_gain, i_gain, d_gain,
+                                                 (frequency_min, frequency_max), error_margin, settling_time)
+            if move_time is None or overshoot > max_overshoot:
+                break
+            total_time += move_time
+        else:
+            mean_time = total_time / (2 * len(distances))
+            if best_time is None or mean_time < best_time:
+                best_time = mean_time
+                best_profile = {'p_gain': p_gain, 'i_gain': i_gain, 'd_gain': d_gain,
+                                'frequency_limits': [frequency_min, frequency_max], 'error_margin': error_margin}
+    return best_profile, best_time
+
+
+def run_step_experiments(controller, distances=STEP_DISTANCES, start_setpoint=0):
+    """Record step responses on the machine by moving back and forth over the given distances.
+    The axis has to be calibrated first.
+
+    Args:
+        controller: Controller object of the axis
+        distances: move distances in mm
+        start_setpoint: setpoint in mm to start and return to
+
+    Returns:
+        list of recorded moves, see Controller.captured_data
+    """
+    controller.recorded_moves = []
+    # Ignore the limit switches while moving away from the zero position, like the first well of a run
+    controller.start(start_setpoint, capture=True, ignore_interrupts=True)
+    for distance in distances:
+        controller.start(start_setpoint + distance, capture=True)
+        controller.start(start_setpoint, capture=True)
+    return controller.recorded_moves
+
+
+def run_axis_experiments(controller, distances=STEP_DISTANCES):
+    """Home an axis and record step responses on the machine, see run_step_experiments
+
+    Args:
+        controller: Controller object of the axis
+        distances: move distances in mm
+
+    Returns:
+        list of recorded moves, see Controller.captured_data
+    """
+    controller.steppermotor.calibrate()
+    controller.caliper.zero()
+    return run_step_experiments(controller, distances)
+
+
+def load_axis_profile(axis, path=AXIS_PROFILE_PATH):
+    """Load the tuned profile of an axis
+
+    Args:
+        axis: axis name
+        path: filepath of the axis profiles
+
+    Returns:
+        profile dict, empty if the axis is not tuned
+    """
+    return load_axis_settings(axis, path)
+
+
+def save_axis_profile(axis, profile, path=AXIS_PROFILE_PATH):
+    """Store the tuned profile of an axis, keeping the other axes"""
+    save_axis_settings(axis, profile, path)
+
+
+if __name__ == '__main__':
+    from globals import CONTROLLER_X_SETTLING_TIME, CONTROLLER_Y_SETTLING_TIME, CONTROLLER_X_ERROR_MARGIN, \
+        CONTROLLER_Y_ERROR_MARGIN
+    axis_settings = {'x': (CONTROLLER_X_SETTLING_TIME, CONTROLLER_X_ERROR_MARGIN),
+                     'y': (CONTROLLER_Y_SETTLING_TIME, CONTROLLER_Y_ERROR_MARGIN)}
+    if sys.argv[1:2] == ['--experiment']:
+        import globals
+        globals.initialise_io()
+        axis_controllers = {'x': globals.controller_x, 'y': globals.controller_y}
+        recorded = {axis_name: run_axis_experiments(axis_controllers[axis_name])
+                    for axis_name in sys.argv[2:] or ['x', 'y']}
+        if not os.path.exists('logs'):
+            os.mkdir('logs')
+        moves_path = 'logs/{}_moves.json'.format(datetime.strftime(datetime.now(), "%Y%m%d%H%M%S"))
+        with open(moves_path, 'w') as moves_file:
+            json.dump(recorded, moves_file)
+        print("moves stored in {}, run backlash.py on it to update the backlash profile".format(moves_path))
+    else:
+        recorded = read_recorded_moves(sys.argv[1:])
+    for axis_name, axis_moves in recorded.items():
+        axis_model = fit_axis_model(axis_moves)
+        axis_settling_time, axis_error_margin = axis_settings[axis_name]
+        axis_profile, axis_time = tune_axis(axis_model, axis_settling_time, axis_error_margin)
+        print("{}: {} mean move time {}".format(axis_name, axis_profile, axis_time))
+        if axis_profile is not None:
+            save_axis_profile(axis_name, axis_profile)
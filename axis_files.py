@@ -0,0 +1,53 @@
+# Json files with a setting or recording per axis, shared by the offline tuning tools backlash.py and autotune.py
+import json
+import os
+
+
+def load_axis_settings(axis, path):
+    """Load the settings of an axis from a json file with the settings of every axis: {"x": {...}, "y": {...}}
+
+    Args:
+        axis: axis name
+        path: filepath of the json file
+
+    Returns:
+        settings dict, empty if the file does not exist or the axis is not in it
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get(axis, {})
+
+
+def save_axis_settings(axis, settings, path):
+    """Store the settings of an axis in a json file with the settings of every axis, keeping the other axes
+
+    Args:
+        axis: axis name
+        settings: settings dict
+        path: filepath of the json file
+    """
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[axis] = settings
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=4)
+
+
+def read_recorded_moves(paths):
+    """Read recorded moves files as written by the run engine: {"x": [move, ...], "y": [move, ...]}
+
+    Args:
+        paths: list of filepaths
+
+    Returns:
+        dict of axis name to the moves of that axis in all files, see Controller.captured_data
+    """
+    recorded = {}
+    for path in paths:
+        with open(path) as f:
+            for axis, moves in json.load(f).items():
+                recorded.setdefault(axis, []).extend(moves)
+    return recorded
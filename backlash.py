@@ -0,0 +1,94 @@
+# Estimate the backlash of the x and y axes from recorded controller moves.
+# Record moves by running a plate with CAPTURE_CONTROLLER_DATA = True in globals.py, then run
+#     python backlash.py logs/<timestamp>_moves.json
+# to write the estimated backlash per axis and direction to BACKLASH_PROFILE_PATH, which initialise_io loads.
+import statistics
+import sys
+from axis_files import load_axis_settings, save_axis_settings, read_recorded_moves
+
+# Profile with the backlash per axis: {"x": {"positive": steps, "negative": steps}, "y": ...}
+BACKLASH_PROFILE_PATH = 'backlash.json'
+
+
+def estimate_backlash(moves, threshold=0.02):
+    """Estimate the backlash in steps for both directions of an axis.
+    After every direction change the steps the motor made are summed until the caliper shows the load moving in the new
+    direction. The steps the motor made while the load did not move are the backlash, the steps that did move the load
+    are subtracted using the steps per mm measured right after.
+
+    Args:
+        moves: list of recorded moves, each a list of (time, position, step rate, reversed) samples
+               as stored in Controller.captured_data, the step rate is the rate the motor actually stepped at
+        threshold: displacement in mm in the new direction that counts as the load moving
+
+    Returns:
+        dict with the median backlash in steps for the 'positive' and 'negative' direction,
+        or None for a direction without any direction changes
+    """
+    estimates = {True: [], False: []}
+    for move in moves:
+        flip = None  # (position at the direction change, direction, steps made since the change)
+        moving = None  # (direction, steps made since the change, displacement) once the load moves
+        for (previous_time, previous_position, _, previous_direction), (sample_time, position, step_rate, direction) \
+                in zip(move, move[1:]):
+            # Every sample holds the mean step rate the motor made since the previous sample and the direction
+            steps = step_rate * (sample_time - previous_time)
+            if moving is not None:
+                # Use the steps per mm of the first sample after the backlash is taken up
+                # to subtract the steps that actually moved the load from the estimate
+                moving_direction, total_steps, displacement = moving
+                delta = position - previous_position if moving_direction else previous_position - position
+                if direction == moving_direction and delta > 0:
+                    estimates[moving_direction].append(max(0, total_steps - displacement * steps / delta))
+                moving = None
+            if flip is None and direction != previous_direction:
+                flip = (previous_position, direction, 0)
+            if flip is None:
+                continue
+            flip_position, flip_direction, total_steps = flip
+            if direction != flip_direction:
+                # Changed direction again before the load moved, discard
+                flip = None
+                continue
+            total_steps += steps
+            displacement = position - flip_position if flip_direction else flip_position - position
+            if displacement > threshold:
+                moving = (flip_direction, total_steps, displacement)
+                flip = None
+            else:
+                flip = (flip_position, flip_direction, total_steps)
+
+    return {'positive': statistics.median(estimates[True]) if estimates[True] else None,
+            'negative': statistics.median(estimates[False]) if estimates[False] else None}
+
+
+def load_backlash(axis, path=BACKLASH_PROFILE_PATH):
+    """Load the backlash of an axis
+
+    Args:
+        axis: axis name
+        path: filepath of the backlash profile
+
+    Returns:
+        (positive, negative) backlash in steps, zero if unknown
+    """
+    profile = load_axis_settings(axis, path)
+    return profile.get('positive') or 0, profile.get('negative') or 0
+
+
+def save_backlash(axis, backlash, path=BACKLASH_PROFILE_PATH):
+    """Store the backlash of an axis in the profile, keeping the other axes
+
+    Args:
+        axis: axis name
+        backlash: dict as returned by estimate_backlash
+        path: filepath of the backlash profile
+    """
+    save_axis_settings(axis, backlash, path)
+
+
+if __name__ == '__main__':
+    for axis_name, axis_moves in read_recorded_moves(sys.argv[1:]).items():
+        axis_backlash = estimate_backlash(axis_moves)
+        print("{}: {}".format(axis_name, axis_backlash))
+        save_backlash(axis_name, axis_backlash)
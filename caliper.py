@@ -1,6 +1,9 @@
 import RPi.GPIO as GPIO
 import time
-from queue import Queue
+from queue import Queue, Empty, Full
+from caliper_log import CaliperRecorder
+from caliper_stats import CaliperStats
+from gpio_events import dispatcher
 
 
 class Caliper:
@@ -42,6 +45,12 @@ class Caliper:
         # Ideally the reading should always processed before the next one is ready (queue size = 1)
         self.reading_queue = Queue(1)
 
+        # Interrupt path and packet health statistics
+        self.stats = CaliperStats()
+
+        # Optional recorder for the raw clock edges, see start_recording
+        self.recorder = None
+
         # keep track of previous readings for median filter
         self.median_filter_samples = [0 for _ in range(median_filter_window_size)]
 
@@ -54,9 +63,9 @@ class Caliper:
         if self.pin_debug is not None:
             GPIO.setup(self.pin_debug, GPIO.OUT)
 
-        # Setup interrupt
+        # Setup interrupt, the data pin has to be sampled on the clock edge so it is handled inline
         self.ignore_interrupt = True
-        GPIO.add_event_detect(self.pin_clock, GPIO.RISING, callback=self.clock_callback)
+        dispatcher.add_fast_handler(self.pin_clock, GPIO.RISING, self.clock_callback)
 
     def start_listening(self):
         """Enable clock interrupt"""
@@ -66,6 +75,11 @@ class Caliper:
         """Reset past samples for median filter to all zeroes"""
         self.median_filter_samples = [0 for _ in range(self.median_filter_window_size)]
 
+    def reset_decoder(self):
+        """Discard a partially received packet, the next clock edge starts a new packet"""
+        self.current_burst_data = list()
+        self.last_clock_time = 0
+
     def stop_listening(self):
         """"Disable clock interrupt"""
         self.ignore_interrupt = True
@@ -73,6 +87,22 @@ class Caliper:
         with self.reading_queue.mutex:
             self.reading_queue.queue.clear()
 
+    def start_recording(self, path):
+        """Record all raw clock edges to a log file until stop_recording is called, see caliper_log.py
+
+        Args:
+            path: filepath of the log file
+        """
+        self.stop_recording()
+        self.recorder = CaliperRecorder(path)
+
+    def stop_recording(self):
+        """Stop recording clock edges and close the log file"""
+        recorder = self.recorder
+        self.recorder = None
+        if recorder is not None:
+            recorder.close()
+
     def get_reading(self, timeout=1):
         """
         Blocks until a value is stored in self.reading_queue by the clock callback or until timeout
@@ -83,7 +113,7 @@ class Caliper:
         Returns:
             The reading in mm or None if it was filtered
         """
-        bit_list = self.reading_queue.get(True, timeout)
+        packet_time, bit_list = self.reading_queue.get(True, timeout)
         bit_list.reverse()
         # bits 0-2 are always 0, bit 3 is the sign where 1 = negative and 0 = positive
         # bit 4-23 needs to be converted to decimal and divided by 100 to get the position in mm (2 decimals)
@@ -91,7 +121,9 @@ class Caliper:
         # use correct sign
         if bit_list[3] == 1:
             value = -value
-        return self.filter(value / 100)
+        value = self.filter(value / 100)
+        self.stats.consumer_lag.add((time.perf_counter() - packet_time) * 1000)
+        return value
 
     def zero(self):
         """Set the current caliper position to be the zero position."""
@@ -99,33 +131,64 @@ class Caliper:
         time.sleep(0.1)
         GPIO.output(self.pin_zero, GPIO.LOW)
 
-    def clock_callback(self, channel):
-        """Called on the clock rising edge.
+    def clock_callback(self, event):
+        """Called on the clock rising edge with a gpio_events.EdgeEvent.
         Sample the data input pin every function call.
         Data is sent in 24-bit bursts every ~100-150ms.
         If listening started mid-burst the data from that first burst will be discarded.
         """
         if self.ignore_interrupt:
             return
+        callback_start = time.perf_counter()
 
         if self.pin_debug is not None:
             GPIO.output(self.pin_debug, GPIO.HIGH)
 
         value = GPIO.input(self.pin_data)
+        timestamp = event.timestamp
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(timestamp, value)
+        self.process_edge(timestamp, value)
+
+        if self.pin_debug is not None:
+            GPIO.output(self.pin_debug, GPIO.LOW)
+        self.stats.callback_time.add((time.perf_counter() - callback_start) * 1000000)
+
+    def process_edge(self, timestamp, value):
+        """Decode a single clock edge, called by clock_callback or when replaying a log.
+
+        Args:
+            timestamp: edge timestamp in seconds
+            value: the sampled data bit
+        """
         # If the last clock pulse was too long ago,
         # discard the current_burst_data buffer and assume a new data packet started.
-        current_time = time.time() * 1000.0
+        current_time = timestamp * 1000.0
         if current_time - self.last_clock_time >= self.pause_time:
+            if self.current_burst_data:
+                self.stats.packet_end(len(self.current_burst_data))
             self.current_burst_data = list()
         self.last_clock_time = current_time
         # Add current data bit to buffer
         self.current_burst_data.append(value)
         # Store buffer in queue when 24 bits have been read.
         if len(self.current_burst_data) == 24:
-            self.reading_queue.put(self.current_burst_data)
-
-        if self.pin_debug is not None:
-            GPIO.output(self.pin_debug, GPIO.LOW)
+            self.stats.packet_complete(timestamp)
+            self.put_reading((time.perf_counter(), self.current_burst_data))
+
+    def put_reading(self, reading):
+        """Put a reading in the queue without blocking the interrupt callback.
+        If the previous reading was not consumed yet it is replaced, the newest reading is the most useful one."""
+        try:
+            self.reading_queue.put_nowait(reading)
+        except Full:
+            self.stats.queue_full += 1
+            try:
+                self.reading_queue.get_nowait()
+            except Empty:
+                pass
+            self.reading_queue.put_nowait(reading)
 
     def filter(self, sample):
         """Attempt to filter out random flipped bits in the data signal due to glitches.
@@ -143,6 +206,7 @@ class Caliper:
         median = sorted_list[self.median_filter_window_size // 2]
 
         if abs(sample - median) > self.median_filter_max_error:
+            self.stats.rejected += 1
             return None
         else:
             self.median_filter_samples.append(sample)
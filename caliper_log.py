@@ -0,0 +1,144 @@
+import array
+import sys
+import threading
+import time
+
+# Every clock edge is stored as a single little endian unsigned 64 bit integer:
+# the edge timestamp in microseconds shifted left by one, with the sampled data bit in the lowest bit.
+LOG_HEADER = b'CALIPERLOG1\n'
+
+
+class CaliperRecorder:
+    def __init__(self, path):
+        """Records the raw clock edge timestamps and data bits seen by Caliper.clock_callback to a binary log file.
+        Recording is cheap enough to run in the interrupt callback: every edge is a single buffered 8 byte write.
+
+        Args:
+            path: filepath of the log file, it is overwritten if it exists
+        """
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(LOG_HEADER)
+        self.edge_count = 0
+
+    def record(self, timestamp, bit):
+        """Store a single clock edge
+
+        Args:
+            timestamp: edge timestamp in seconds
+            bit: sampled data bit (0 or 1)
+        """
+        self.file.write((int(timestamp * 1000000) << 1 | bit).to_bytes(8, 'little'))
+        self.edge_count += 1
+
+    def close(self):
+        """Flush and close the log file"""
+        self.file.close()
+
+
+def read_log(path):
+    """Read a caliper log file
+
+    Args:
+        path: filepath of a log file written by CaliperRecorder
+
+    Returns:
+        list of (timestamp in seconds, data bit) tuples
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(LOG_HEADER)) != LOG_HEADER:
+            raise ValueError("{} is not a caliper log file".format(path))
+        edges = array.array('Q')
+        edges.frombytes(f.read())
+    if sys.byteorder != 'little':
+        edges.byteswap()
+    return [((edge >> 1) / 1000000, edge & 1) for edge in edges]
+
+
+def decode_log(path, caliper):
+    """Decode a log through the caliper decoder and median filter as fast as possible.
+    The result only depends on the log and the caliper filter settings, which makes it useful for regression tests
+    and for benchmarking decoder or filter changes on recorded data.
+
+    Args:
+        path: filepath of a log file written by CaliperRecorder
+        caliper: Caliper object, its decoder and median filter are reset first
+
+    Returns:
+        list of (packet timestamp in seconds, reading in mm or None if it was filtered) tuples
+    """
+    caliper.reset_decoder()
+    caliper.reset_median_filter()
+    caliper.stop_listening()
+    readings = []
+    for timestamp, bit in read_log(path):
+        caliper.process_edge(timestamp, bit)
+        if not caliper.reading_queue.empty():
+            readings.append((timestamp, caliper.get_reading(0)))
+    return readings
+
+
+def start_replay(path, caliper, speed=100.0, stop_event=None):
+    """Feed a log into a caliper in its own thread, as if the edges came from the clock interrupt.
+    Edges are paced by their recorded timestamps divided by speed.
+    Like the live interrupt, edges are ignored while the caliper is not listening.
+
+    Args:
+        path: filepath of a log file written by CaliperRecorder
+        caliper: Caliper object to feed
+        speed: replay speed relative to real time
+        stop_event: optional threading.Event to stop the replay early
+
+    Returns:
+        the started threading.Thread, it finishes when the whole log is replayed
+    """
+    edges = read_log(path)
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def replay():
+        if not edges:
+            return
+        log_start = edges[0][0]
+        replay_start = time.time()
+        for timestamp, bit in edges:
+            if stop_event.is_set():
+                break
+            # Only sleep when more than a millisecond ahead, sleeping for every edge would be too coarse
+            delay = (timestamp - log_start) / speed - (time.time() - replay_start)
+            if delay > 0.001:
+                time.sleep(delay)
+            if not caliper.ignore_interrupt:
+                caliper.process_edge(timestamp, bit)
+
+    thread = threading.Thread(target=replay)
+    thread.start()
+    return thread
+
+
+def replay_controller(path, controller, setpoint, speed=100.0):
+    """Run the control loop of a controller on a recorded caliper log instead of the live caliper.
+    The settling time of the controller is divided by speed for the duration of the replay.
+
+    Args:
+        path: filepath of a log file written by CaliperRecorder
+        controller: Controller object, its caliper is fed from the log
+        setpoint: setpoint in mm for the control loop
+        speed: replay speed relative to real time
+
+    Returns:
+        controller.captured_data of the replayed run
+    """
+    stop_event = threading.Event()
+    settling_time = controller.settling_time
+    controller.settling_time = settling_time / speed
+    controller.caliper.reset_median_filter()
+    thread = start_replay(path, controller.caliper, speed, stop_event)
+    try:
+        controller.start(setpoint, capture=True)
+    finally:
+        controller.settling_time = settling_time
+        stop_event.set()
+        controller.caliper.stop_listening()
+        thread.join()
+    return controller.captured_data
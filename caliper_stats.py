@@ -0,0 +1,98 @@
+import bisect
+import json
+
+
+class Histogram:
+    def __init__(self, bin_edges):
+        """Fixed bin histogram that is cheap enough to update from an interrupt callback.
+
+        Args:
+            bin_edges: sorted list of bin edges, values below the first or above the last edge get their own bin
+        """
+        self.bin_edges = list(bin_edges)
+        self.counts = [0 for _ in range(len(self.bin_edges) + 1)]
+        self.total = 0
+        self.maximum = None
+
+    def add(self, value):
+        """Add a value to the histogram"""
+        self.counts[bisect.bisect_right(self.bin_edges, value)] += 1
+        self.total += 1
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def reset(self):
+        """Remove all values"""
+        self.counts = [0 for _ in range(len(self.bin_edges) + 1)]
+        self.total = 0
+        self.maximum = None
+
+    def as_dict(self):
+        return {'bin_edges': self.bin_edges, 'counts': self.counts, 'total': self.total, 'maximum': self.maximum}
+
+
+class CaliperStats:
+    def __init__(self):
+        """Always-on counters and histograms describing the health of the caliper interrupt path.
+
+        Attributes:
+            packets: number of complete 24 bit packets
+            framing_errors: number of packets that did not have exactly 24 clock edges
+            queue_full: number of readings that replaced a reading that was not consumed yet
+            rejected: number of readings rejected by the median filter
+            packet_interval: time between complete packets in ms
+            edges_per_packet: number of clock edges per packet
+            callback_time: execution time of the clock callback in us
+            consumer_lag: time from packet completion until get_reading returns in ms
+        """
+        self.packet_interval = Histogram([50, 75, 100, 125, 150, 200, 300, 500, 1000])
+        self.edges_per_packet = Histogram(list(range(1, 30)))
+        self.callback_time = Histogram([10, 20, 50, 100, 200, 500, 1000, 5000])
+        self.consumer_lag = Histogram([1, 2, 5, 10, 20, 50, 100, 200, 500])
+        self.reset()
+
+    def reset(self):
+        """Reset all counters and histograms, call this at the start of a run"""
+        self.packets = 0
+        self.framing_errors = 0
+        self.queue_full = 0
+        self.rejected = 0
+        self.last_packet_time = None
+        for histogram in (self.packet_interval, self.edges_per_packet, self.callback_time, self.consumer_lag):
+            histogram.reset()
+
+    def packet_complete(self, timestamp):
+        """Called when a packet is complete
+
+        Args:
+            timestamp: timestamp of the last clock edge in seconds
+        """
+        self.packets += 1
+        if self.last_packet_time is not None:
+            self.packet_interval.add((timestamp - self.last_packet_time) * 1000)
+        self.last_packet_time = timestamp
+
+    def packet_end(self, edge_count):
+        """Called when a new packet starts, with the number of edges of the previous packet"""
+        self.edges_per_packet.add(edge_count)
+        if edge_count != 24:
+            self.framing_errors += 1
+
+    def as_dict(self):
+        return {'packets': self.packets,
+                'framing_errors': self.framing_errors,
+                'queue_full': self.queue_full,
+                'rejected': self.rejected,
+                'packet_interval_ms': self.packet_interval.as_dict(),
+                'edges_per_packet': self.edges_per_packet.as_dict(),
+                'callback_time_us': self.callback_time.as_dict(),
+                'consumer_lag_ms': self.consumer_lag.as_dict()}
+
+    def write(self, path):
+        """Export the statistics to a json file
+
+        Args:
+            path: filepath of the json file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
@@ -1,17 +1,55 @@
 from picamera import PiCamera
 from picamera.exc import PiCameraError
+import threading
 import time
 import os
+from capture_planner import crop_box_to_pixels
+from capture_profile import FILE_EXTENSIONS
 
 
 class Camera:
     def __init__(self):
-        """Interfaces to a raspberry pi camera to take pictures and save them to a given path."""
+        """Interfaces to a raspberry pi camera to take pictures and save them to a given path.
+        Opening the camera takes a while, so it is opened in a background thread and only waited for on first use.
+        """
+        self._camera = None
+        self.opened = threading.Event()
+        threading.Thread(target=self._open, daemon=True).start()
+        self.profile = None  # CaptureProfile of the running plate, or None for the default camera settings
+
+    def _open(self):
         try:
-            self.camera = PiCamera()
+            self._camera = PiCamera()
         except PiCameraError as e:
             # Camera not connected
-            self.camera = None
+            self._camera = None
+        finally:
+            self.opened.set()
+
+    @property
+    def camera(self):
+        """The PiCamera object or None if no camera is connected, waits until the camera is opened"""
+        self.opened.wait()
+        return self._camera
+
+    def apply_profile(self, profile):
+        """Configure the camera for a run, all following photos are taken with this profile
+
+        Args:
+            profile: capture_profile.CaptureProfile
+        """
+        self.profile = profile
+        if self.camera is None:
+            return
+        self.camera.resolution = profile.resolution
+        self.camera.zoom = profile.zoom or (0.0, 0.0, 1.0, 1.0)
+        # Constant u and v planes give a gray image, which the encoder compresses much better
+        self.camera.color_effects = (128, 128) if profile.grayscale else None
+
+    def _photo_path(self, name):
+        """Filepath in pics/ with the extension of the capture format"""
+        extension = 'jpg' if self.profile is None else FILE_EXTENSIONS[self.profile.format]
+        return os.path.join(os.path.dirname(__file__), 'pics/{}.{}'.format(name, extension))
 
     def take_photo(self, filename=None):
         """Take a photo and return the stored image path when ready
@@ -25,11 +63,130 @@ class Camera:
         if not os.path.exists('pics'):
             os.mkdir('pics')
         if filename is None:
-            image_path = os.path.join(os.path.dirname(__file__), 'pics/well_plate_{}.jpg'.format(time.time()))
+            image_path = self._photo_path('well_plate_{}'.format(time.time()))
         else:
-            image_path = os.path.join(os.path.dirname(__file__), 'pics/{}.jpg'.format(filename))
+            image_path = self._photo_path(filename)
 
         if self.camera is not None:
-            self.camera.capture(image_path)
+            if self.profile is None:
+                self.camera.capture(image_path)
+            elif self.profile.format == 'jpeg':
+                self.camera.capture(image_path, format='jpeg', quality=self.profile.quality)
+            else:
+                self.camera.capture(image_path, format=self.profile.format)
+
+        return image_path
+
+    def capture_frame(self):
+        """Capture a full photo with the resolution of the capture profile as an uncompressed rgb array.
 
+        Returns:
+            numpy array with shape (height, width, 3) or None if no camera is connected
+        """
+        import numpy as np  # Imported on first use, numpy is slow to import
+        if self.camera is None:
+            return None
+        width, height = self.camera.resolution
+        # Unencoded captures are padded to a multiple of 32 pixels horizontally and 16 vertically
+        padded_width, padded_height = (width + 31) // 32 * 32, (height + 15) // 16 * 16
+        output = np.empty((padded_height, padded_width, 3), dtype=np.uint8)
+        self.camera.capture(output, format='rgb')
+        return output[:height, :width]
+
+    def save_frame(self, frame, filename):
+        """Encode a frame from capture_frame with the format of the capture profile and save it in pics/
+
+        Args:
+            frame: numpy array with shape (height, width, 3) or None if no camera is connected
+            filename: the name of the photo file.
+
+        Returns:
+            the filepath of the saved photo file
+        """
+        from PIL import Image  # Imported on first use, PIL is slow to import
+        if not os.path.exists('pics'):
+            os.mkdir('pics')
+        image_path = self._photo_path(filename)
+        if frame is None:
+            return image_path
+        image = Image.fromarray(frame)
+        if self.profile is not None and self.profile.grayscale:
+            image = image.convert('L')
+        if self.profile is not None and self.profile.format == 'jpeg':
+            image.save(image_path, quality=self.profile.quality)
+        else:
+            image.save(image_path)
         return image_path
+
+    def capture_array(self, resolution=(320, 240)):
+        """Quickly grab a low resolution frame from the video port without saving it.
+
+        Args:
+            resolution: (width, height) of the frame, width should be a multiple of 32 and height a multiple of 16
+
+        Returns:
+            numpy array with shape (height, width, 3) or None if no camera is connected
+        """
+        import numpy as np  # Imported on first use, numpy is slow to import
+        if self.camera is None:
+            return None
+        width, height = resolution
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.camera.capture(frame, format='rgb', resize=resolution, use_video_port=True)
+        return frame
+
+    def stream_frames(self, resolution=(160, 128)):
+        """Continuously grab low resolution frames from the video port.
+        The same array is reused for every frame, so copy a frame that has to be kept.
+
+        Args:
+            resolution: (width, height) of the frames, width should be a multiple of 32 and height a multiple of 16
+
+        Yields:
+            numpy array with shape (height, width, 3), nothing if no camera is connected
+        """
+        import numpy as np  # Imported on first use, numpy is slow to import
+        if self.camera is None:
+            return
+        width, height = resolution
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frames = self.camera.capture_continuous(frame, format='rgb', resize=resolution, use_video_port=True)
+        try:
+            for _ in frames:
+                yield frame
+        finally:
+            frames.close()
+
+    def crop_photo(self, image_path, wells, fov_width, fov_height, filename_format):
+        """Crop the wells visible in a photo into separate image files
+
+        Args:
+            image_path: path of the photo to crop
+            wells: list of (well index, crop box) tuples, see capture_planner.CapturePosition
+            fov_width: width of the camera field of view in mm
+            fov_height: height of the camera field of view in mm
+            filename_format: format string for the well photo file names, formatted with the 1-based well number
+
+        Returns:
+            dict of well index to the filepath of the saved well photo
+        """
+        from PIL import Image  # Imported on first use, PIL is slow to import
+        paths = {}
+        for index, _ in wells:
+            paths[index] = self._photo_path(filename_format.format(index + 1))
+        if not os.path.exists(image_path):
+            # No camera connected
+            return paths
+        with Image.open(image_path) as image:
+            for index, box in wells:
+                well_image = image.crop(crop_box_to_pixels(box, image.size, fov_width, fov_height))
+                if self.profile is None:
+                    well_image.save(paths[index])
+                    continue
+                if self.profile.grayscale:
+                    well_image = well_image.convert('L')
+                if self.profile.format == 'jpeg':
+                    well_image.save(paths[index], quality=self.profile.quality)
+                else:
+                    well_image.save(paths[index])
+        return paths
@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+# A single camera position and the wells that are visible in the photo taken there.
+# x, y: the setpoint in mm to move the camera to
+# wells: list of (well index, crop box) tuples. The crop box is (left, top, right, bottom) in mm relative to the
+#        centre of the photo along the image axes, or None if the whole photo belongs to the well.
+CapturePosition = namedtuple('CapturePosition', ['x', 'y', 'wells'])
+
+
+def single_well_plan(setpoints):
+    """Plan one camera position per well, this is the same as moving to and photographing every well separately.
+
+    Args:
+        setpoints: list of (x, y) well setpoints in mm in the order they should be visited
+
+    Returns:
+        list of CapturePosition
+    """
+    return [CapturePosition(x, y, [(index, None)]) for index, (x, y) in enumerate(setpoints)]
+
+
+def plan_captures(setpoints, well_diameter, fov_width, fov_height, margin=1.0, axis_signs=(1, 1)):
+    """Group wells into the fewest camera positions where every well is fully inside the camera field of view.
+    Wells are planned in the order they are given, so the resulting positions roughly follow the same path.
+    For every well that is not planned yet, a field of view is placed with that well in each of its four corners.
+    The placement covering the most unplanned wells is used, and the camera is centered on the wells it covers.
+
+    If a single well does not fit in the field of view every well gets its own position without cropping.
+
+    Args:
+        setpoints: list of (x, y) well setpoints in mm in the order they should be visited
+        well_diameter: well diameter in mm
+        fov_width: width of the camera field of view in mm (x direction)
+        fov_height: height of the camera field of view in mm (y direction)
+        margin: extra space in mm to keep around each well when cropping
+        axis_signs: (x, y) 1 if the image axis points in the same direction as the machine axis, -1 if it is flipped.
+                    The crop boxes are in image axes, so a flipped camera crops the right well.
+
+    Returns:
+        list of CapturePosition
+    """
+    radius = well_diameter / 2 + margin
+    if 2 * radius > fov_width or 2 * radius > fov_height:
+        return single_well_plan(setpoints)
+
+    planned = set()
+    plan = []
+    for index, (x0, y0) in enumerate(setpoints):
+        if index in planned:
+            continue
+        best = None
+        for sign_x in (1, -1):
+            for sign_y in (1, -1):
+                # Field of view with this well's footprint in one of the corners
+                if sign_x > 0:
+                    min_x, max_x = x0 - radius, x0 - radius + fov_width
+                else:
+                    min_x, max_x = x0 + radius - fov_width, x0 + radius
+                if sign_y > 0:
+                    min_y, max_y = y0 - radius, y0 - radius + fov_height
+                else:
+                    min_y, max_y = y0 + radius - fov_height, y0 + radius
+                covered = [i for i, (x, y) in enumerate(setpoints) if i not in planned and
+                           min_x <= x - radius and x + radius <= max_x and
+                           min_y <= y - radius and y + radius <= max_y]
+                if best is None or len(covered) > len(best):
+                    best = covered
+
+        # Center the camera on the bounding box of the covered wells
+        xs = [setpoints[i][0] for i in best]
+        ys = [setpoints[i][1] for i in best]
+        centre_x = round((min(xs) + max(xs)) / 2, 2)
+        centre_y = round((min(ys) + max(ys)) / 2, 2)
+        wells = []
+        for i in best:
+            x, y = setpoints[i]
+            image_x = (x - centre_x) * axis_signs[0]
+            image_y = (y - centre_y) * axis_signs[1]
+            wells.append((i, (image_x - radius, image_y - radius, image_x + radius, image_y + radius)))
+            planned.add(i)
+        plan.append(CapturePosition(centre_x, centre_y, wells))
+    return plan
+
+
+def crop_box_to_pixels(box, image_size, fov_width, fov_height):
+    """Convert a crop box in mm relative to the photo centre to a pixel box usable by PIL.Image.crop
+
+    Args:
+        box: (left, top, right, bottom) in mm relative to the centre of the photo along the image axes
+        image_size: (width, height) of the photo in pixels
+        fov_width: width of the camera field of view in mm
+        fov_height: height of the camera field of view in mm
+
+    Returns:
+        (left, top, right, bottom) in pixels, clipped to the image
+    """
+    width, height = image_size
+    scale_x = width / fov_width
+    scale_y = height / fov_height
+    left, top, right, bottom = box
+    return (max(0, int(round(width / 2 + left * scale_x))),
+            max(0, int(round(height / 2 + top * scale_y))),
+            min(width, int(round(width / 2 + right * scale_x))),
+            min(height, int(round(height / 2 + bottom * scale_y))))
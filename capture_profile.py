@@ -0,0 +1,107 @@
+from collections import namedtuple
+import math
+
+# Camera settings used for every photo of a run
+# resolution: (width, height) of the photo in pixels
+# zoom: (x, y, width, height) region of the sensor to capture as fractions of the full field of view,
+#       or None to capture the full field of view, see PiCamera.zoom
+# field_of_view: (width, height) in mm of the area of the well plate in the photo
+# format: 'jpeg' or 'png'
+# quality: jpeg quality 1-100, not used for png
+# grayscale: True to capture without color, which encodes smaller and faster
+CaptureProfile = namedtuple('CaptureProfile', ['resolution', 'zoom', 'field_of_view', 'format', 'quality',
+                                               'grayscale'])
+
+# File extension of every capture format
+FILE_EXTENSIONS = {'jpeg': 'jpg', 'png': 'png'}
+
+
+def estimate_pitch(setpoints):
+    """Estimate the well pitch of a layout as the median distance from a well to its nearest neighbour.
+    The median ignores the few wells that are closer together because of the hysteresis offset.
+
+    Args:
+        setpoints: list of (x, y) well setpoints in mm
+
+    Returns:
+        pitch in mm, or None if the layout has less than 2 wells
+    """
+    nearest = []
+    for i, (x0, y0) in enumerate(setpoints):
+        distances = [math.hypot(x1 - x0, y1 - y0) for j, (x1, y1) in enumerate(setpoints) if j != i]
+        distances = [distance for distance in distances if distance > 0]
+        if distances:
+            nearest.append(min(distances))
+    if not nearest:
+        return None
+    nearest.sort()
+    return nearest[len(nearest) // 2]
+
+
+def frame_resolution(field_of_view, width):
+    """Resolution of a low resolution video port frame with the aspect ratio of the field of view,
+    so the pixels are square and a round well stays round in the frame.
+
+    Args:
+        field_of_view: (width, height) in mm of the area in the frame, see CaptureProfile.field_of_view
+        width: approximate width of the frame in pixels
+
+    Returns:
+        (width, height) in pixels, the width is a multiple of 32 and the height a multiple of 16 as the video port
+        requires
+    """
+    fov_width, fov_height = field_of_view
+    width = max(32, int(round(width / 32)) * 32)
+    height = max(16, int(round(width * fov_height / fov_width / 16)) * 16)
+    return width, height
+
+
+def compute_capture_profile(setpoints, well_diameter, captures, fov_width, fov_height, margin, pixels_per_mm,
+                            sensor_resolution, image_format='jpeg', quality=85, grayscale=False):
+    """Compute the capture profile of a compiled layout.
+    When every camera position photographs a single well, the sensor is zoomed in on the footprint of the well:
+    the well diameter plus the margin when it is known, otherwise the well pitch.
+    When multiple wells are photographed at once the full field of view is needed for cropping, so there is no zoom.
+    The resolution is chosen so the photo has pixels_per_mm, limited to the sensor pixels in the captured region.
+
+    Args:
+        setpoints: list of (x, y) well setpoints in mm
+        well_diameter: well diameter in mm or None
+        captures: list of capture_planner.CapturePosition
+        fov_width: width of the full camera field of view in mm
+        fov_height: height of the full camera field of view in mm
+        margin: extra space in mm to keep around each well
+        pixels_per_mm: photo resolution on the well plate
+        sensor_resolution: (width, height) of the camera sensor in pixels
+        image_format: 'jpeg' or 'png'
+        quality: jpeg quality 1-100
+        grayscale: True to capture without color
+
+    Returns:
+        CaptureProfile
+    """
+    if image_format not in FILE_EXTENSIONS:
+        raise ValueError("Unsupported capture format {}".format(image_format))
+
+    if any(len(capture.wells) > 1 for capture in captures):
+        footprint = None
+    elif well_diameter is not None:
+        footprint = well_diameter + 2 * margin
+    else:
+        footprint = estimate_pitch(setpoints)
+
+    if footprint is None or (footprint >= fov_width and footprint >= fov_height):
+        zoom = None
+        width, height = fov_width, fov_height
+    else:
+        width, height = min(footprint, fov_width), min(footprint, fov_height)
+        zoom_width, zoom_height = width / fov_width, height / fov_height
+        zoom = ((1 - zoom_width) / 2, (1 - zoom_height) / 2, zoom_width, zoom_height)
+
+    # Never ask for more pixels than the sensor has in the captured region
+    max_width = sensor_resolution[0] * width / fov_width
+    max_height = sensor_resolution[1] * height / fov_height
+    scale = min(pixels_per_mm, max_width / width, max_height / height)
+    # Even dimensions are required by the encoders
+    resolution = (2 * int(round(width * scale / 2)), 2 * int(round(height * scale / 2)))
+    return CaptureProfile(resolution, zoom, (width, height), image_format, quality, grayscale)
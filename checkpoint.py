@@ -0,0 +1,100 @@
+import json
+import os
+
+# Directory where the progress of every run is stored
+CHECKPOINT_DIRECTORY = 'runs'
+
+
+class RunCheckpoint:
+    def __init__(self, path, run_id, setpoints, well_diameter=None, completed=None, photos=None, finished=False):
+        """Durable per-well progress of a run, so an interrupted run can be resumed where it stopped.
+        The checkpoint is stored as a json file that is atomically replaced every time a well is completed.
+
+        Args:
+            path: filepath of the checkpoint json file
+            run_id: run id, used as the timestamp in the photo file names
+            setpoints: list of (x, y) well setpoints in mm, stored so a resumed run uses the exact same positions
+            well_diameter: well diameter in mm or None, see CompiledLayout
+            completed: list of indices of the wells that are photographed
+            photos: dict of well index to photo filepath
+            finished: True if the run completed all wells
+        """
+        self.path = path
+        self.run_id = run_id
+        self.setpoints = [tuple(setpoint) for setpoint in setpoints]
+        self.well_diameter = well_diameter
+        self.completed = set(completed or [])
+        self.photos = dict(photos or {})
+        self.finished = finished
+
+    @classmethod
+    def create(cls, run_id, setpoints, well_diameter=None, directory=CHECKPOINT_DIRECTORY):
+        """Create and save the checkpoint for a new run"""
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        checkpoint = cls(os.path.join(directory, '{}.json'.format(run_id)), run_id, setpoints, well_diameter)
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def load(cls, path):
+        """Load a checkpoint from a json file"""
+        with open(path) as f:
+            data = json.load(f)
+        return cls(path, data['run_id'], data['setpoints'], data['well_diameter'], data['completed'],
+                   {int(index): photo for index, photo in data['photos'].items()}, data['finished'])
+
+    def is_completed(self, well_index):
+        return well_index in self.completed
+
+    def mark_completed(self, photos):
+        """Mark wells as completed and save the checkpoint
+
+        Args:
+            photos: dict of well index to photo filepath
+        """
+        self.photos.update(photos)
+        self.completed.update(photos.keys())
+        self.save()
+
+    def finish(self):
+        """Mark the run as finished and save the checkpoint"""
+        self.finished = True
+        self.save()
+
+    def save(self):
+        """Write the checkpoint to a temporary file and atomically replace the old checkpoint with it,
+        so a power failure or crash never leaves a half written checkpoint behind."""
+        data = {'run_id': self.run_id,
+                'setpoints': self.setpoints,
+                'well_diameter': self.well_diameter,
+                'completed': sorted(self.completed),
+                'photos': self.photos,
+                'finished': self.finished}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+def latest_unfinished_checkpoint(directory=CHECKPOINT_DIRECTORY):
+    """Find the most recent run that did not finish
+
+    Args:
+        directory: directory with checkpoint json files
+
+    Returns:
+        RunCheckpoint or None if there is no unfinished run
+    """
+    if not os.path.exists(directory):
+        return None
+    # Run ids are timestamps, so sorting by name sorts by start time
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        checkpoint = RunCheckpoint.load(os.path.join(directory, filename))
+        if not checkpoint.finished:
+            return checkpoint
+    return None
@@ -2,12 +2,13 @@ from pid_controller.pid import PID
 import threading
 import queue
 import time
-from tkinter import messagebox
+from run_control import RunStopped
 
 
 class Controller:
     def __init__(self, proportional_gain, integral_gain, differential_gain, stepper_motor, caliper, error_margin,
-                 steppermotor_frequency_limits, settling_time, name, setpoint_offset, interrupt_ignore_time):
+                 steppermotor_frequency_limits, settling_time, name, setpoint_offset, interrupt_ignore_time,
+                 backlash_steps=(0, 0), max_rejected_readings=3):
         """This class controls a single steppermotor-caliper feedback loop, by moving the load to a given setpoint.
 
         Args:
@@ -22,6 +23,11 @@ class Controller:
             name: name for debugging
             setpoints_offset: This is the offset that when given as a setpoint should move the camera to the middle of the first well
             interrupt_ignore_time: The time to ignore interrupts for in seconds when temp_disable_interrupts is called
+            backlash_steps: tuple with the backlash in steps after changing to the positive and negative direction,
+                            a burst of these steps is made at the maximum frequency every time the motor changes
+                            direction
+            max_rejected_readings: the number of consecutive readings rejected by the caliper filter after which the
+                                   control loop is stopped, isolated rejected readings are replaced by an estimate
         """
         self.pid = PID(p=proportional_gain, i=integral_gain, d=differential_gain)  # P I D controller
         self.steppermotor = stepper_motor  # The stepper motor moving the load
@@ -37,53 +43,94 @@ class Controller:
 
         self.start_settling_time = None  # timestamp when settling started
         self.settling = False  # true if within allowed error band
+        self.coarse_band = None  # If set, stop as soon as the error is within this band without settling
+        self.stable_event = None  # If set, settling ends when this threading.Event is set instead of after settling_time
+        self.backlash_steps = {True: backlash_steps[0], False: backlash_steps[1]}  # Keyed by steppermotor.reversed
         self.captured_data = []  # Stores captured data for visualization and debugging purposes
+        self.recorded_moves = []  # captured_data of every move since the last clear
+        self.fault_policy = RejectedReadingPolicy(max_rejected_readings)
+        self.stop_reason = None  # Why the control loop stopped last
 
-    def _control_loop(self, capture_data):
+    def _control_loop(self, capture_data, run_control=None):
         """The control loop, self.start and self.stop start and stop this control loop in it's own thread.
         The load will be moved to the set self.setpoint
         The control loop will continue until it reaches ist setpoint, stopped by the user, by a limit switch being hit,
         or by the caliper timing out.
 
         Args:
-            capture_data: True to save timestamps and position samples to self.captured_data
+            capture_data: True to save timestamps, position samples and the step rate the motor made and the direction
+                          commanded since the previous sample to self.captured_data
+            run_control: optional RunControl, the motor is halted while the run is paused and the loop stops when the
+                         run is stopped
 
         """
         start_time = time.time()
         first_run = True
+        sample_time = start_time  # Time of the previous captured sample
+        sample_steps = self.steppermotor.steps_made()  # Steps made until the previous captured sample
         while not self.stop_loop_event.is_set():
             # Wait for the next sensor reading
-            # If the next reading is filtered wait until a correct reading is received
             try:
-                failed = False
                 position = self.caliper.get_reading()
-                while position is None:
-                    failed = True
-                    self.steppermotor.set_duty_cycle(0)
-                    position = self.caliper.get_reading()
             except queue.Empty:
                 # Timed out waiting for sensor reading
                 # Check if the process was stopped while waiting for sensor reading
                 if self.stop_loop_event.is_set():
                     break
                 else:
+                    self.stop_reason = "caliper timeout"
                     raise TimeoutError("Controller {} timed out waiting for sensor reading".format(self.name))
-            finally:
-                # Start the motor again if it was stopped before due to filtered data
-                if failed:
-                    self.steppermotor.set_duty_cycle(50)
 
-            if capture_data:
-                self.captured_data.append((time.time() - start_time, position))
+            # Every reading is a safe point to pause or stop the move
+            if run_control is not None:
+                try:
+                    run_control.checkpoint(self._pause_motor, self._unpause_motor)
+                except RunStopped:
+                    self.stop_reason = "stopped"
+                    self.stop()
+                    break
+                if self.stop_loop_event.is_set():
+                    break
+
+            # Keep moving on an estimated position if the reading was filtered
+            estimated = position is None
+            try:
+                position = self.fault_policy.update(position, time.time())
+            except ControllerFault as e:
+                self.stop()
+                self.stop_reason = str(e)
+                raise ControllerFault("Controller {} stopped: {}".format(self.name, e))
+            if position is None:
+                # No estimate possible before the first valid reading
+                continue
+
+            if capture_data and not estimated:
+                # Store the step rate the motor actually made since the previous sample, including backlash bursts
+                now, steps = time.time(), self.steppermotor.steps_made()
+                step_rate = (steps - sample_steps) / (now - sample_time) if now > sample_time else 0
+                self.captured_data.append((now - start_time, position, step_rate, self.steppermotor.reversed))
+                sample_time, sample_steps = now, steps
 
             error = self.setpoint - position
 
+            # Stop early when only a coarse position is needed, the final position is corrected by the caller
+            if self.coarse_band is not None and abs(error) < self.coarse_band and not estimated:
+                print("coarse stop {} {}".format(self.name, position))
+                self.stop()
+                self.stop_reason = "setpoint"
+                break
+
             # Check if the goal position was reached
-            # The loop is stopped when the load has been in it's allowed error band for at least the given settling time.
-            if abs(error) < self.error_margin:
-                if self.settling and time.time() - self.start_settling_time > self.settling_time:
+            # The loop is stopped when the load has been in it's allowed error band for at least the given settling time,
+            # or when the camera image is stable if settling on the image.
+            # Estimated positions are never trusted to finish settling.
+            if estimated:
+                pass
+            elif abs(error) < self.error_margin:
+                if self.settling and self._settled():
                     print("stop {} {}".format(self.name, position))
                     self.stop()
+                    self.stop_reason = "setpoint"
                     break
                 elif not self.settling:
                     self.settling = True
@@ -98,15 +145,14 @@ class Controller:
             # Use the controller output to set the stepper motor speed
             if self.steppermotor.stop_step_event.is_set() and not first_run:
                 # The steppermotor stopped unexpectedly -> Limit switch was hit
-                # Stop the entire process
-                # Importing stop_process here to prevent circular import
-                from main import stop_process
-                stop_process()
-                messagebox.showerror('Foutmelding', 'Een eindschakelaar is geraakt tijdens het proces.')
-                break
+                # Stop the control loop, the caller stops the entire process
+                self.stop()
+                self.stop_reason = "limit switch"
+                raise ControllerFault('Een eindschakelaar is geraakt tijdens het proces.')
 
             # Set correct motor direction
-            if output > 0 and not self.steppermotor.reversed or output <= 0 and self.steppermotor.reversed:
+            reversing = output > 0 and not self.steppermotor.reversed or output <= 0 and self.steppermotor.reversed
+            if reversing:
                 self.steppermotor.reverse()
 
             # Set motor step frequency, clipping it to the upper and lower limit
@@ -114,25 +160,81 @@ class Controller:
                 output = self.step_frequency_max
             elif abs(output) < self.step_frequency_min:
                 output = self.step_frequency_min
+            self.steppermotor.frequency = abs(output)
 
             # Start the motor on the first loop iteration
             if first_run:
                 self.steppermotor.start_step()
 
-            # Set the step frequency
-            self.steppermotor.frequency = abs(output)
+            # Take up the backlash for the new direction with a burst of steps at full speed,
+            # the load does not move during the burst so the controller output is not needed
+            backlash_steps = self.backlash_steps[self.steppermotor.reversed]
+            if reversing and backlash_steps > 0:
+                checkpoint = None
+                if run_control is not None:
+                    def checkpoint():
+                        run_control.checkpoint(self._pause_motor, self._unpause_motor)
+                try:
+                    self.steppermotor.step_burst(backlash_steps, self.step_frequency_max, checkpoint)
+                except RunStopped:
+                    self.stop_reason = "stopped"
+                    self.stop()
+                    break
 
             first_run = False
 
-    def start(self, setpoint, capture=False, ignore_interrupts=False):
-        """Start the control loop by starting the caliper interrupt, setting the setpoint and calling _control_loop"""
+    def _settled(self):
+        """True if the load has settled, called while the position is within the error band"""
+        stable_event = self.stable_event  # Can be set to None from another thread
+        if stable_event is not None:
+            return stable_event.is_set()
+        return time.time() - self.start_settling_time > self.settling_time
+
+    def _pause_motor(self):
+        """Halt the motor while the run is paused, without stopping the control loop.
+        The load does not count as settling while paused, see motion_settle.monitor_stability."""
+        self.settling = False
+        self.steppermotor.set_duty_cycle(0)
+
+    def _unpause_motor(self):
+        """Continue after a pause. The position estimate and settling time from before the pause are discarded."""
+        self.fault_policy.reset()
+        self.settling = False
+        self.start_settling_time = None
+        self.steppermotor.set_duty_cycle(50)
+
+    def start(self, setpoint, capture=False, ignore_interrupts=False, coarse_band=None, run_control=None,
+              stable_event=None):
+        """Start the control loop by starting the caliper interrupt, setting the setpoint and calling _control_loop
+
+        Args:
+            setpoint: setpoint in mm, self.setpoint_offset is added to it
+            capture: True to save timestamps and position samples to self.captured_data
+            ignore_interrupts: True to ignore limit switch interrupts for self.interrupt_ignore_time seconds
+            coarse_band: if given, stop as soon as the error is within +- coarse_band mm instead of settling
+            run_control: optional RunControl to pause or stop the move, see _control_loop
+            stable_event: optional threading.Event that is set while the camera image is stable, see motion_settle.py.
+                          If given, the move ends as soon as the position is within the error band and the image is
+                          stable, instead of after the fixed settling time. Set self.stable_event to None during the
+                          move to settle on the fixed settling time after all.
+        """
         self.stop_loop_event.clear()
+        self.coarse_band = coarse_band
+        self.stable_event = stable_event
+        self.settling = False
+        self.start_settling_time = None
+        self.stop_reason = "stopped"
+        self.fault_policy.reset()
         self.caliper.start_listening()
         self.setpoint = setpoint + self.setpoint_offset
         self.captured_data = []
         if ignore_interrupts:
             threading.Thread(target=self.temp_disable_interrupts).start()
-        self._control_loop(capture)
+        try:
+            self._control_loop(capture, run_control)
+        finally:
+            if capture:
+                self.recorded_moves.append(self.captured_data)
 
     def temp_disable_interrupts(self):
         """ignore limit switch interrupts for a set time"""
@@ -149,3 +251,56 @@ class Controller:
     def wait_until_finished(self):
         """Blocks until the control loop stops."""
         self.stop_loop_event.wait()
+
+
+class ControllerFault(RuntimeError):
+    pass
+
+
+class RejectedReadingPolicy:
+    def __init__(self, max_rejected_readings):
+        """Decides what the control loop does with readings rejected by the caliper filter.
+        An isolated rejected reading is replaced by extrapolating the last valid readings, so the motor keeps moving
+        instead of stopping for a whole packet period. After max_rejected_readings consecutive rejected readings
+        the position is no longer trusted and ControllerFault is raised.
+
+        Args:
+            max_rejected_readings: number of consecutive rejected readings that stops the control loop
+        """
+        self.max_rejected_readings = max_rejected_readings
+        self.reset()
+
+    def reset(self):
+        """Forget the previous readings, call this before every move"""
+        self.rejected_readings = 0
+        self.last_position = None
+        self.last_time = None
+        self.velocity = 0
+
+    def update(self, position, timestamp):
+        """Process a new reading
+
+        Args:
+            position: the reading in mm or None if it was rejected
+            timestamp: time of the reading in seconds
+
+        Returns:
+            the position, an estimated position if it was rejected, or None if there is nothing to estimate from
+
+        Raises:
+            ControllerFault: after max_rejected_readings consecutive rejected readings
+        """
+        if position is not None:
+            if self.last_time is not None and timestamp > self.last_time:
+                self.velocity = (position - self.last_position) / (timestamp - self.last_time)
+            self.last_position = position
+            self.last_time = timestamp
+            self.rejected_readings = 0
+            return position
+
+        self.rejected_readings += 1
+        if self.rejected_readings >= self.max_rejected_readings:
+            raise ControllerFault("{} consecutive caliper readings rejected".format(self.rejected_readings))
+        if self.last_position is None:
+            return None
+        return self.last_position + self.velocity * (timestamp - self.last_time)
@@ -0,0 +1,557 @@
+import asyncio
+import importlib
+import json
+import os
+import threading
+from datetime import datetime
+from controller import ControllerFault
+from steppermotor import CalibrationError
+from checkpoint import RunCheckpoint, latest_unfinished_checkpoint
+from run_control import RunControl, RunStopped
+from capture_profile import compute_capture_profile, frame_resolution
+from globals import CAMERA_FOV_WIDTH, CAMERA_FOV_HEIGHT, CAMERA_CROP_MARGIN, CAMERA_SENSOR_RESOLUTION, \
+    CAPTURE_PIXELS_PER_MM, CAPTURE_FORMAT, CAPTURE_QUALITY, CAPTURE_GRAYSCALE, VISION_POSITIONING_ENABLED, \
+    VISION_COARSE_BAND, VISION_ACCEPT_RADIUS, VISION_FRAME_WIDTH, CAMERA_IMAGE_AXIS_SIGNS, \
+    CALIPER_RECORDING_ENABLED, QUALITY_CHECK_ENABLED, QUALITY_MIN_SHARPNESS, QUALITY_MIN_HIGHLIGHT, \
+    QUALITY_MAX_CLIPPED_FRACTION, QUALITY_MAX_MOTION_BLUR, QUALITY_MAX_RECAPTURES, IMAGE_SETTLE_ENABLED, \
+    IMAGE_SETTLE_FRAME_WIDTH, IMAGE_SETTLE_MAX_DIFFERENCE, IMAGE_SETTLE_STABLE_FRAMES, IMAGE_SETTLE_TIMEOUT, \
+    FRAME_STACK_ENABLED
+
+
+# numpy and PIL based modules, imported while homing instead of at startup, see preload_image_modules
+IMAGE_MODULES = ('vision', 'frame_quality', 'motion_settle', 'frame_stack', 'PIL.Image')
+
+
+class EngineError(RuntimeError):
+    pass
+
+
+def preload_image_modules():
+    """Import the numpy and PIL based modules in the background, so the first photo does not wait for them
+    and starting the engine does not either"""
+    for name in IMAGE_MODULES:
+        importlib.import_module(name)
+
+
+def capture_distance(a, b):
+    """Travel cost between two (position number, CapturePosition) pairs.
+    Both axes move at the same time, so the longest axis move determines the travel time."""
+    return max(abs(a[1].x - b[1].x), abs(a[1].y - b[1].y))
+
+
+class RunEngine:
+    def __init__(self, controller_x, controller_y, camera, plate_library):
+        """Headless engine that runs well plates, without any user interface.
+        The engine has an asyncio API (submit, pause, unpause, stop, subscribe) that runs on its own event loop.
+        The run itself is blocking hardware code and runs in a worker thread.
+        Progress is pushed as events, dicts with a 'type' key:
+            status: {'text'} status text for the operator
+            run_started: {'run_id', 'wells'}
+            well_done: {'wells', 'photos', 'photo'} the photographed wells, their photo paths and the full photo
+            recapture: {'wells', 'problems'} the photo of these wells failed the quality check and is taken again later
+            paused, unpaused: {}
+            run_finished: {'run_id', 'result'} result is 'completed', 'stopped' or 'error'
+            error: {'message'}
+
+        Args:
+            controller_x: Controller object of the x axis
+            controller_y: Controller object of the y axis
+            camera: Camera object
+            plate_library: PlateLibrary object with the compiled plates
+        """
+        self.controller_x = controller_x
+        self.controller_y = controller_y
+        self.camera = camera
+        self.plate_library = plate_library
+
+        self.loop = None  # Event loop of the asyncio API, see start
+        self.subscribers = set()  # asyncio.Queue objects that receive every event
+        self.listeners = []  # Callables that receive every event in the thread that emitted it
+        self.run_control = RunControl()  # Pauses and stops the run at the next safe point
+        self.run_future = None  # Future of the running run or None
+        self.starting = False  # True while submit prepares a run
+
+    # Thread-safe entry points, for callers outside the event loop such as the gui and gpio interrupts
+
+    def start(self):
+        """Start the event loop of the engine in its own thread"""
+        ready = threading.Event()
+
+        def run_loop():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        threading.Thread(target=run_loop, daemon=True).start()
+        ready.wait()
+
+    def call(self, coroutine):
+        """Run a coroutine of the asyncio API from another thread
+
+        Returns:
+            concurrent.futures.Future with the result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def add_listener(self, listener):
+        """Call listener with every event, from the thread that emitted it"""
+        self.listeners.append(listener)
+
+    # asyncio API
+
+    @property
+    def running(self):
+        return self.starting or self.run_future is not None and not self.run_future.done()
+
+    async def submit(self, plate=None, setpoints_path=None, resume=False, capture_data=False):
+        """Start a run
+
+        Args:
+            plate: name of a plate in the plate library
+            setpoints_path: path to a setpoints csv file, used when plate is None
+            resume: True to continue the most recent unfinished run instead
+            capture_data: True to record the controller moves, see Controller.captured_data
+
+        Returns:
+            the run id
+
+        Raises:
+            EngineError: if a run is already running, no plate or setpoints file is given, the plate is unknown
+                         or there is no run to resume
+            LayoutError: if the plate layout is invalid
+        """
+        if self.running:
+            raise EngineError("Er loopt al een run")
+        if not resume and plate is None and setpoints_path is None:
+            raise EngineError("Geen well plate of setpoints bestand opgegeven")
+        # Compiling a layout and creating the checkpoint read and write files, keep them off the event loop
+        self.starting = True
+        try:
+            layout, checkpoint = await self.loop.run_in_executor(None, self._prepare_run, plate, setpoints_path,
+                                                                 resume)
+            self.run_control.reset()
+            self.run_future = self.loop.run_in_executor(None, self._run_safely, layout, checkpoint, capture_data)
+        finally:
+            self.starting = False
+        return checkpoint.run_id
+
+    def _prepare_run(self, plate, setpoints_path, resume):
+        """Compile the layout and load or create the checkpoint of a run, see submit
+
+        Returns:
+            (layout, checkpoint)
+        """
+        if resume:
+            checkpoint = latest_unfinished_checkpoint()
+            if checkpoint is None:
+                raise EngineError("Er is geen onderbroken run om te hervatten")
+            layout = self.plate_library.compile_setpoints(checkpoint.setpoints, checkpoint.well_diameter)
+        else:
+            if plate is not None:
+                try:
+                    layout = self.plate_library.get(plate)
+                except KeyError:
+                    raise EngineError("Onbekende well plate {}".format(plate))
+            else:
+                layout = self.plate_library.compile_csv(setpoints_path)
+            checkpoint = RunCheckpoint.create(datetime.strftime(datetime.now(), "%Y%m%d%H%M%S"),
+                                              layout.setpoints, layout.well_diameter)
+        return layout, checkpoint
+
+    async def pause(self):
+        """Pause the run, a move in progress is halted until the run is unpaused"""
+        if not self.run_control.paused:
+            self.run_control.pause()
+            self._emit('status', text="GEPAUZEERD")
+            self._emit('paused')
+
+    async def unpause(self):
+        """Continue a paused run"""
+        if self.run_control.paused:
+            self.run_control.unpause()
+            self._emit('unpaused')
+
+    async def stop(self):
+        """Stop the run, the controllers and the steppermotors"""
+        self.run_control.stop()
+        self.controller_x.stop()
+        self.controller_y.stop()
+
+    async def wait_until_finished(self):
+        """Wait for the running run to finish"""
+        if self.run_future is not None:
+            await self.run_future
+
+    def subscribe(self):
+        """Subscribe to the events, must be called from the event loop
+
+        Returns:
+            asyncio.Queue that receives every event
+        """
+        subscriber = asyncio.Queue()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    # Run implementation, runs in a worker thread
+
+    def _emit(self, event_type, **data):
+        """Push an event to all listeners and subscribers, can be called from any thread"""
+        event = dict(data, type=event_type)
+        for listener in self.listeners:
+            listener(event)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._publish, event)
+
+    def _publish(self, event):
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+
+    def _run_safely(self, layout, checkpoint, capture_data):
+        """Run _run and report unexpected errors as events instead of losing them in the worker thread"""
+        try:
+            self._run(layout, checkpoint, capture_data)
+        except Exception as e:
+            self.controller_x.stop()
+            self.controller_y.stop()
+            self._emit('error', message=repr(e))
+            self._emit('status', text="STANDBY")
+            self._emit('run_finished', run_id=checkpoint.run_id, result='error')
+
+    def _run(self, layout, checkpoint, capture_data):
+        """Positions the camera above each well of a compiled plate layout by starting the x and y controllers.
+        If multiple wells fit in the camera field of view,
+        the camera is positioned above groups of wells and each photo is cropped into one image per well.
+        Progress is checkpointed after every photo, so an interrupted run can be resumed.
+        With FRAME_STACK_ENABLED the raw frame of every well is also written to a FrameStack for reanalysis.
+        Every photo is checked for sharpness, exposure and motion blur before it is accepted,
+        positions with a bad photo are visited again later in the same run, see frame_quality.insert_recapture.
+        The run pauses and stops at the safe points of self.run_control: during a move, before a move,
+        and after a move before the photo is taken. A photo is always written and checkpointed once it is taken.
+
+        Args:
+            layout: CompiledLayout to run
+            checkpoint: RunCheckpoint of the run, completed wells are skipped
+            capture_data: True to save datapoints to a list (controller.captured_data)
+        """
+        controller_x, controller_y, camera = self.controller_x, self.controller_y, self.camera
+        timestamp = checkpoint.run_id
+        setpoints = layout.setpoints
+        well_diameter = layout.well_diameter
+        captures = layout.captures
+        self._emit('run_started', run_id=timestamp, wells=len(setpoints))
+        threading.Thread(target=preload_image_modules, daemon=True).start()
+
+        # Calibrate the steppermotors and calipers
+        self._emit('status', text="KALIBREREN")
+        errors = self._calibrate_all()
+        try:
+            self.run_control.checkpoint()
+        except RunStopped:
+            self._emit('status', text="STANDBY")
+            self._emit('run_finished', run_id=timestamp, result='stopped')
+            return
+        if errors:
+            self._emit('error', message=str(errors[0]))
+            self._emit('status', text="STANDBY")
+            self._emit('run_finished', run_id=timestamp, result='error')
+            return
+
+        # Configure the camera once for the whole run, after homing so homing does not wait for the camera to open.
+        # With vision positioning the photo is cropped around the found well centre, so keep room for the offset.
+        margin = CAMERA_CROP_MARGIN + (VISION_ACCEPT_RADIUS if VISION_POSITIONING_ENABLED else 0)
+        profile = compute_capture_profile(setpoints, well_diameter, captures, CAMERA_FOV_WIDTH, CAMERA_FOV_HEIGHT,
+                                          margin, CAPTURE_PIXELS_PER_MM, CAMERA_SENSOR_RESOLUTION, CAPTURE_FORMAT,
+                                          CAPTURE_QUALITY, CAPTURE_GRAYSCALE)
+        camera.apply_profile(profile)
+        fov_width, fov_height = profile.field_of_view
+
+        # Reset median filter values to all zeroes
+        controller_x.caliper.reset_median_filter()
+        controller_y.caliper.reset_median_filter()
+
+        old_setpoint_x, old_setpoint_y = None, None
+
+        # On the first pair of setpoints ignore interrupts while moving away from the limit switches.
+        first_well = True
+
+        if not os.path.exists('logs'):
+            os.mkdir('logs')
+        controller_x.caliper.stats.reset()
+        controller_y.caliper.stats.reset()
+        controller_x.recorded_moves = []
+        controller_y.recorded_moves = []
+
+        result = 'completed'
+        # Remaining (position number, CapturePosition) pairs, positions with a bad photo are inserted again
+        pending = list(enumerate(captures))
+        recaptures = {}  # Position number to the number of times it was photographed again
+        frame_stack = None
+        # The recordings, frame stack and logs are closed and written however the run ends
+        try:
+            if CALIPER_RECORDING_ENABLED:
+                controller_x.caliper.start_recording('logs/{}_caliper_x.bin'.format(timestamp))
+                controller_y.caliper.start_recording('logs/{}_caliper_y.bin'.format(timestamp))
+
+            # Raw frames of every well for reanalysis, next to the encoded photos
+            if FRAME_STACK_ENABLED:
+                from frame_stack import FrameStack, well_frame_size
+                frame_stack = FrameStack.create(timestamp, setpoints, well_frame_size(captures, profile),
+                                                1 if profile.grayscale else 3)
+
+            while pending:
+                counter, capture = pending.pop(0)
+                planned_capture = capture
+                # Skip positions of which all wells were photographed before the run was interrupted
+                if all(checkpoint.is_completed(index) for index, _ in capture.wells):
+                    continue
+
+                # Count camera positions, a position can hold several wells in any order
+                self._emit('status', text="{} {}/{}".format("WELL" if len(captures) == len(setpoints) else "POSITIE",
+                                                            counter + 1, len(captures)))
+
+                setpoint_x, setpoint_y = capture.x, capture.y
+                self.run_control.checkpoint()
+
+                # Stop the controllers early when the final position is found with the camera
+                vision = VISION_POSITIONING_ENABLED and len(capture.wells) == 1 and capture.wells[0][1] is not None
+                errors = self._move_camera(setpoint_x, setpoint_y, old_setpoint_x, old_setpoint_y, capture_data,
+                                           first_well, VISION_COARSE_BAND if vision else None,
+                                           IMAGE_SETTLE_ENABLED and not vision)
+                if vision and not errors:
+                    offset = self._locate_well(well_diameter, fov_width, fov_height)
+                    if offset is None:
+                        # Well not found, settle on the setpoint instead
+                        errors = self._move_camera(setpoint_x, setpoint_y, None, None, capture_data,
+                                                   settle_on_image=IMAGE_SETTLE_ENABLED)
+                    elif abs(offset[0]) > VISION_ACCEPT_RADIUS or abs(offset[1]) > VISION_ACCEPT_RADIUS:
+                        # One corrective move, after which the well is assumed to be in the centre.
+                        # The offset is along the image axes, convert it to the machine axes.
+                        setpoint_x = round(setpoint_x + offset[0] * CAMERA_IMAGE_AXIS_SIGNS[0], 2)
+                        setpoint_y = round(setpoint_y + offset[1] * CAMERA_IMAGE_AXIS_SIGNS[1], 2)
+                        errors = self._move_camera(setpoint_x, setpoint_y, None, None, capture_data,
+                                                   settle_on_image=IMAGE_SETTLE_ENABLED)
+                    else:
+                        # Close enough, crop the photo to the well centre instead of moving.
+                        # The crop box and the offset are both along the image axes.
+                        index, (left, top, right, bottom) = capture.wells[0]
+                        capture = capture._replace(wells=[(index, (left + offset[0], top + offset[1],
+                                                                   right + offset[0], bottom + offset[1]))])
+                if errors and not self.run_control.stopped:
+                    # The run can be resumed later from the last completed well
+                    controller_x.stop()
+                    controller_y.stop()
+                    self._emit('error', message=str(errors[0]))
+                    result = 'error'
+                    break
+
+                old_setpoint_x = setpoint_x
+                old_setpoint_y = setpoint_y
+                first_well = False
+
+                # Last safe point before the photo
+                self.run_control.checkpoint()
+
+                # Take a picture
+                if capture.wells[0][1] is None:
+                    filename = "{}_{}_of_{}".format(timestamp, capture.wells[0][0] + 1, len(setpoints))
+                else:
+                    filename = "{}_position_{}_of_{}".format(timestamp, counter + 1, len(captures))
+                if frame_stack is None:
+                    photo_path = camera.take_photo(filename)
+                else:
+                    frame = camera.capture_frame()
+                    photo_path = camera.save_frame(frame, filename)
+
+                # Photograph the position again later in this run if the photo is not usable
+                if QUALITY_CHECK_ENABLED and recaptures.get(counter, 0) < QUALITY_MAX_RECAPTURES:
+                    from frame_quality import assess_photo, insert_recapture
+                    quality = assess_photo(photo_path, QUALITY_MIN_SHARPNESS, QUALITY_MIN_HIGHLIGHT,
+                                           QUALITY_MAX_CLIPPED_FRACTION, QUALITY_MAX_MOTION_BLUR)
+                    if quality is not None and quality.problems:
+                        recaptures[counter] = recaptures.get(counter, 0) + 1
+                        if not pending:
+                            # No position left to visit in between, settle on this position again
+                            # instead of taking the photo again right away
+                            old_setpoint_x, old_setpoint_y = None, None
+                        insert_recapture(pending, (counter, planned_capture), capture_distance)
+                        self._emit('recapture', wells=[index + 1 for index, _ in capture.wells],
+                                   problems=quality.problems)
+                        continue
+
+                if capture.wells[0][1] is None:
+                    photos = {capture.wells[0][0]: photo_path}
+                else:
+                    # Crop the photo into separate images for every well in view
+                    photos = camera.crop_photo(photo_path, capture.wells, fov_width, fov_height,
+                                               "{}_{{}}_of_{}".format(timestamp, len(setpoints)))
+                if frame_stack is not None and frame is not None:
+                    self._write_frames(frame_stack, frame, capture.wells, fov_width, fov_height)
+                checkpoint.mark_completed(photos)
+                self._emit('well_done', wells=[index + 1 for index, _ in capture.wells],
+                           photos={index + 1: path for index, path in photos.items()}, photo=photo_path)
+            else:
+                checkpoint.finish()
+        except RunStopped:
+            # The controllers and steppermotors are stopped by stop
+            result = 'stopped'
+        finally:
+            controller_x.caliper.stop_recording()
+            controller_y.caliper.stop_recording()
+            if frame_stack is not None:
+                frame_stack.close()
+            controller_x.caliper.stats.write('logs/{}_caliper_x_stats.json'.format(timestamp))
+            controller_y.caliper.stats.write('logs/{}_caliper_y_stats.json'.format(timestamp))
+            if capture_data:
+                # Recorded moves for backlash.py
+                with open('logs/{}_moves.json'.format(timestamp), 'w') as f:
+                    json.dump({'x': controller_x.recorded_moves, 'y': controller_y.recorded_moves}, f)
+        self._emit('status', text="EINDE - STANDBY" if result == 'completed' else "STANDBY")
+        self._emit('run_finished', run_id=timestamp, result=result)
+
+    def _write_frames(self, frame_stack, frame, wells, fov_width, fov_height):
+        """Write the raw frame of every well in a photo to the frame stack
+
+        Args:
+            frame_stack: FrameStack of the run
+            frame: numpy array with the full photo, see Camera.capture_frame
+            wells: list of (well index, crop box) tuples, see capture_planner.CapturePosition
+            fov_width: width of the photo in mm
+            fov_height: height of the photo in mm
+        """
+        from frame_stack import crop_frame
+        _, height, width, channels = frame_stack.frames.shape
+        for index, box in wells:
+            well_frame = frame if box is None else crop_frame(frame, box, fov_width, fov_height, (width, height))
+            # Grayscale frames have three equal channels, only the first is stored
+            frame_stack.write(index, well_frame[..., :channels])
+
+    def _calibrate_all(self):
+        """Calibrate the x and y steppermotors to their zero position.
+        Both calipers are also zeroed when the steppermotors reach this position.
+        At the moment is z steppermotor is not connected nor does it have any limit switches, so it is not calibrated
+
+        Homing pauses and stops with the run.
+
+        Returns:
+            list of CalibrationErrors, empty if both axes are calibrated or the run was stopped
+        """
+        errors = []
+
+        def calibrate_and_zero(controller):
+            steppermotor = controller.steppermotor
+
+            def checkpoint():
+                self.run_control.checkpoint(lambda: steppermotor.set_duty_cycle(0),
+                                            lambda: steppermotor.set_duty_cycle(50))
+
+            try:
+                steppermotor.calibrate(checkpoint)
+            except CalibrationError as e:
+                errors.append(e)
+                return
+            except RunStopped:
+                # Reported by the checkpoint after homing
+                return
+            # Zero the caliper while the steppermotor is on its home position.
+            controller.caliper.zero()
+
+        # Calibrate steppermotors simultaneously
+        threads = [threading.Thread(target=calibrate_and_zero, args=[controller])
+                   for controller in (self.controller_x, self.controller_y)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def _move_camera(self, setpoint_x, setpoint_y, old_setpoint_x=None, old_setpoint_y=None, capture_data=False,
+                     first_well=False, coarse_band=None, settle_on_image=False):
+        """Move the camera to a setpoint by running both controllers simultaneously.
+        Axes that are already on their setpoint are not moved.
+        When settling on the image, low resolution frames are streamed during the move and the controllers stop as
+        soon as they are within their error band and the image is stable, see motion_settle.monitor_stability.
+
+        Args:
+            setpoint_x: x setpoint in mm
+            setpoint_y: y setpoint in mm
+            old_setpoint_x: the previous x setpoint in mm, or None to always move
+            old_setpoint_y: the previous y setpoint in mm, or None to always move
+            capture_data: True to save datapoints to a list (controller.captured_data)
+            first_well: True to ignore the limit switch interrupts while moving away from the zero position
+            coarse_band: see Controller.start
+            settle_on_image: True to end the move on a stable camera image instead of the fixed settling time
+
+        Returns:
+            list of errors raised by the controllers, empty if both reached their setpoint
+        """
+        # Start the controllers in their own thread, to wait for both of them to finish asynchronously.
+        errors = []
+        stable_event = threading.Event() if settle_on_image else None
+
+        def run_controller(controller, setpoint):
+            try:
+                controller.start(setpoint, capture_data, first_well, coarse_band, self.run_control, stable_event)
+            except (TimeoutError, ControllerFault) as e:
+                errors.append(e)
+
+        moving = []
+        if setpoint_x != old_setpoint_x:
+            moving.append((self.controller_x, setpoint_x))
+        if setpoint_y != old_setpoint_y:
+            moving.append((self.controller_y, setpoint_y))
+        threads = [threading.Thread(target=run_controller, args=[controller, setpoint])
+                   for controller, setpoint in moving]
+        for thread in threads:
+            thread.start()
+
+        monitor = None
+        if settle_on_image and threads:
+            from motion_settle import monitor_stability
+            finished_event = threading.Event()
+
+            def in_band():
+                return all(controller.settling for controller, _ in moving)
+
+            def fall_back():
+                # Without a stable image the controllers settle on their fixed settling time
+                for controller, _ in moving:
+                    controller.stable_event = None
+
+            # Square pixels, so a shift of the image counts the same along both axes
+            field_of_view = (CAMERA_FOV_WIDTH, CAMERA_FOV_HEIGHT) if self.camera.profile is None \
+                else self.camera.profile.field_of_view
+            resolution = frame_resolution(field_of_view, IMAGE_SETTLE_FRAME_WIDTH)
+            monitor = threading.Thread(target=monitor_stability,
+                                       args=[self.camera.stream_frames(resolution), stable_event,
+                                             finished_event, in_band, IMAGE_SETTLE_MAX_DIFFERENCE,
+                                             IMAGE_SETTLE_STABLE_FRAMES, IMAGE_SETTLE_TIMEOUT, fall_back])
+            monitor.start()
+
+        for thread in threads:
+            thread.join()
+        if monitor is not None:
+            finished_event.set()
+            monitor.join()
+        return errors
+
+    def _locate_well(self, well_diameter, fov_width, fov_height):
+        """Grab a low resolution frame and locate the well in it
+
+        Args:
+            well_diameter: well diameter in mm
+            fov_width: width of the frame in mm, see CaptureProfile.field_of_view
+            fov_height: height of the frame in mm
+
+        Returns:
+            (x, y) offset in mm of the well centre from the centre of the frame along the image axes,
+            or None if the well could not be found
+        """
+        from vision import well_offset
+        frame = self.camera.capture_array(frame_resolution((fov_width, fov_height), VISION_FRAME_WIDTH))
+        if frame is None:
+            return None
+        return well_offset(frame, well_diameter, fov_width, fov_height)
@@ -0,0 +1,120 @@
+from collections import namedtuple
+import os
+import numpy as np
+from PIL import Image
+
+# Result of a frame quality check
+# sharpness: variance of the laplacian of the downscaled gray frame, low for out of focus or blurred frames
+# highlight: 99th percentile of the gray levels, low when even the brightest part of the frame is dark
+# bright_fraction: fraction of pixels that are clipped white
+# motion_blur: 0 for equally fine detail along x and y, up to 0.75 when the fine detail is smeared out in one direction
+# problems: list of reasons the frame failed, empty if the frame is usable
+FrameQuality = namedtuple('FrameQuality', ['sharpness', 'highlight', 'bright_fraction', 'motion_blur', 'problems'])
+
+
+def load_gray_thumbnail(image_path, max_size=256):
+    """Load a photo as a small gray numpy array.
+    For jpeg photos the decoder downscales while decoding, so the full resolution image is never decoded.
+
+    Args:
+        image_path: path of the photo
+        max_size: maximum width and height of the thumbnail in pixels
+
+    Returns:
+        numpy float32 array with shape (height, width) and values 0-255
+    """
+    with Image.open(image_path) as image:
+        image.draft('L', (max_size, max_size))
+        image = image.convert('L')
+        image.thumbnail((max_size, max_size))
+        return np.asarray(image, dtype=np.float32)
+
+
+def _detail_ratio(gray, axis):
+    """Ratio of the fine to the coarse gradient energy along an axis of a gray frame.
+    The ratio is about 4 for sharp edges and drops to 1 when the edges are smeared over 4 pixels or more.
+    Detail in the scene that runs along the axis, such as the walls of the wells, lowers both energies alike,
+    and an axis without any detail only has sensor noise, which counts as sharp.
+
+    Returns:
+        the ratio from 1 to 4, or None if the frame is completely flat along the axis
+    """
+    fine = float(np.square(np.diff(gray, axis=axis)).mean())
+    coarse = np.take(gray, range(4, gray.shape[axis]), axis=axis) - \
+        np.take(gray, range(gray.shape[axis] - 4), axis=axis)
+    coarse = float(np.square(coarse).mean())
+    if coarse < 1:
+        return None
+    return min(4.0, max(1.0, 16 * fine / coarse))
+
+
+def assess_frame(gray, min_sharpness, min_highlight, max_clipped_fraction, max_motion_blur):
+    """Check the sharpness, exposure and motion blur of a gray frame
+
+    Args:
+        gray: numpy array with shape (height, width) and values 0-255
+        min_sharpness: minimum variance of the laplacian
+        min_highlight: minimum gray level of the brightest percent of the pixels
+        max_clipped_fraction: maximum fraction of pixels that may be clipped white
+        max_motion_blur: maximum motion blur, see FrameQuality
+
+    Returns:
+        FrameQuality
+    """
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1])
+    sharpness = float(laplacian.var())
+    # Black well walls and background are not underexposed, a frame is only too dark when its highlights are
+    highlight = float(np.percentile(gray, 99))
+    bright_fraction = float(np.count_nonzero(gray >= 253)) / gray.size
+
+    # A move that has not damped out smears the image along the direction of motion, which removes the fine
+    # detail in that direction but not the coarse detail, and leaves the perpendicular direction sharp
+    ratio_x, ratio_y = _detail_ratio(gray, 1), _detail_ratio(gray, 0)
+    if ratio_x is not None and ratio_y is not None:
+        motion_blur = 1 - min(ratio_x, ratio_y) / max(ratio_x, ratio_y)
+    else:
+        motion_blur = 0.0
+
+    problems = []
+    if sharpness < min_sharpness:
+        problems.append('onscherp')
+    if highlight < min_highlight:
+        problems.append('onderbelicht')
+    if bright_fraction > max_clipped_fraction:
+        problems.append('overbelicht')
+    if motion_blur > max_motion_blur:
+        problems.append('bewegingsonscherpte')
+    return FrameQuality(sharpness, highlight, bright_fraction, motion_blur, problems)
+
+
+def assess_photo(image_path, min_sharpness, min_highlight, max_clipped_fraction, max_motion_blur):
+    """Check the quality of a saved photo, see assess_frame
+
+    Returns:
+        FrameQuality or None if the photo does not exist, for example when no camera is connected
+    """
+    if not os.path.exists(image_path):
+        return None
+    return assess_frame(load_gray_thumbnail(image_path), min_sharpness, min_highlight, max_clipped_fraction,
+                        max_motion_blur)
+
+
+def insert_recapture(pending, item, distance):
+    """Insert a camera position to photograph again into the remaining path,
+    where it adds the least travel (cheapest insertion).
+    The position is never inserted before the next position, so it is not revisited immediately: the conditions that
+    spoiled the photo, such as a move that has not damped out yet, would be the same.
+    Only when no positions remain it is revisited immediately, the caller has to settle on it again first.
+
+    Args:
+        pending: list of the remaining items in visiting order, updated in place
+        item: item to insert
+        distance: callable taking two items and returning the travel cost between them
+    """
+    best_index = len(pending)
+    best_cost = distance(pending[-1], item) if pending else 0
+    for i in range(1, len(pending)):
+        cost = distance(pending[i - 1], item) + distance(item, pending[i]) - distance(pending[i - 1], pending[i])
+        if cost < best_cost:
+            best_index, best_cost = i, cost
+    pending.insert(best_index, item)
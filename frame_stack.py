@@ -0,0 +1,155 @@
+import json
+import os
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Directory where the raw frame stacks of the runs are stored
+FRAME_STACK_DIRECTORY = 'frames'
+
+
+class FrameStack:
+    def __init__(self, path, frames, header):
+        """Raw, uncompressed frames of every well of a run in a single memory mapped array, for fast reanalysis.
+        The frames are stored in a .npy file with shape (wells, height, width, channels) and dtype uint8,
+        next to a json header with the run id, setpoints and the time every well was written.
+        Wells are written as the run progresses, wells that are not written yet are all zeroes.
+        Use create to start a new stack and open_frame_stack to read one.
+
+        Args:
+            path: filepath of the .npy file, the header is stored at the same path with the .json extension
+            frames: numpy memmap of the frames
+            header: dict with the header, see create
+        """
+        self.path = path
+        self.header_path = os.path.splitext(path)[0] + '.json'
+        self.frames = frames
+        self.header = header
+
+    @classmethod
+    def create(cls, run_id, setpoints, frame_size, channels, directory=FRAME_STACK_DIRECTORY):
+        """Create the frame stack of a run, or open it to continue writing when the run is resumed.
+        A stack of the run with a different frame size, for example when the capture settings changed before the run
+        was resumed, or a stack that can not be opened is kept and the frames are written to a new file
+        <run_id>_2.npy, <run_id>_3.npy and so on.
+
+        Args:
+            run_id: run id, used as the file name
+            setpoints: list of (x, y) well setpoints in mm, the wells are stored in this order
+            frame_size: (width, height) of a single well frame in pixels
+            channels: 3 for rgb frames or 1 for grayscale frames
+
+        Returns:
+            FrameStack
+        """
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        path = os.path.join(directory, '{}.npy'.format(run_id))
+        width, height = frame_size
+        shape = (len(setpoints), height, width, channels)
+        number = 1
+        while os.path.exists(path):
+            try:
+                frames, header = open_frame_stack(path, 'r+')
+            except (OSError, ValueError):
+                # The header is missing or a file is damaged, for example after a crash while the stack was created
+                frames = None
+            if frames is not None and frames.shape == shape:
+                return cls(path, frames, header)
+            del frames
+            number += 1
+            path = os.path.join(directory, '{}_{}.npy'.format(run_id, number))
+        # The file is sparse, so the space of wells that are not written yet is not allocated
+        frames = open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        header = {'run_id': run_id,
+                  'setpoints': [list(setpoint) for setpoint in setpoints],
+                  'shape': list(shape),
+                  'timestamps': {}}
+        stack = cls(path, frames, header)
+        stack.save_header()
+        return stack
+
+    def write(self, well_index, frame):
+        """Write the frame of a single well and flush it to the file
+
+        Args:
+            well_index: index of the well in the setpoints
+            frame: numpy array with shape (height, width, channels)
+        """
+        self.frames[well_index] = frame
+        self.frames.flush()
+        self.header['timestamps'][str(well_index)] = time.time()
+        self.save_header()
+
+    def save_header(self):
+        """Atomically replace the json header, see RunCheckpoint.save"""
+        temp_path = self.header_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.header, f)
+        os.replace(temp_path, self.header_path)
+
+    def close(self):
+        self.frames.flush()
+        del self.frames
+
+
+def open_frame_stack(path, mode='r'):
+    """Open a frame stack for reading. Slicing the frames reads only the requested wells or channels from the file,
+    for example frames[5] for the sixth well or frames[..., 1] for the green channel of every well.
+
+    Args:
+        path: filepath of the .npy file
+        mode: 'r' to read or 'r+' to read and write
+
+    Returns:
+        (frames, header) the numpy memmap of the frames and the header dict,
+        the 'timestamps' in the header lists the wells that are written
+    """
+    with open(os.path.splitext(path)[0] + '.json') as f:
+        header = json.load(f)
+    return open_memmap(path, mode=mode), header
+
+
+def well_frame_size(captures, profile):
+    """Size of a single well frame in a frame stack
+
+    Args:
+        captures: list of capture_planner.CapturePosition of the run
+        profile: capture_profile.CaptureProfile of the run
+
+    Returns:
+        (width, height) in pixels, the full photo or the crop box of a well when wells are cropped from the photo
+    """
+    box = captures[0].wells[0][1]
+    if box is None:
+        return profile.resolution
+    scale_x = profile.resolution[0] / profile.field_of_view[0]
+    scale_y = profile.resolution[1] / profile.field_of_view[1]
+    left, top, right, bottom = box
+    return int(round((right - left) * scale_x)), int(round((bottom - top) * scale_y))
+
+
+def crop_frame(frame, box, fov_width, fov_height, frame_size):
+    """Crop a well out of a frame with a fixed size, parts of the box outside the frame are filled with zeroes
+
+    Args:
+        frame: numpy array with shape (height, width, channels)
+        box: (left, top, right, bottom) in mm relative to the centre of the frame, see capture_planner.CapturePosition
+        fov_width: width of the frame in mm
+        fov_height: height of the frame in mm
+        frame_size: (width, height) of the cropped frame in pixels, see well_frame_size
+
+    Returns:
+        numpy array with shape (frame_size[1], frame_size[0], channels)
+    """
+    height, width = frame.shape[:2]
+    crop_width, crop_height = frame_size
+    left = int(round(width / 2 + box[0] * width / fov_width))
+    top = int(round(height / 2 + box[1] * height / fov_height))
+    crop = np.zeros((crop_height, crop_width, frame.shape[2]), dtype=frame.dtype)
+    source_left, source_top = max(left, 0), max(top, 0)
+    source_right, source_bottom = min(left + crop_width, width), min(top + crop_height, height)
+    if source_right > source_left and source_bottom > source_top:
+        crop[source_top - top:source_bottom - top, source_left - left:source_right - left] = \
+            frame[source_top:source_bottom, source_left:source_right]
+    return crop
@@ -1,8 +1,8 @@
 # run to generate testsetpoints.csv
 
 
-def generate_setpoints(initial_offset_y, initial_offset_x, offset_x, offset_y, rows, columns, hysteresis_offset):
-    """Write setpoints to testsetpoints.csv
+def compute_setpoints(initial_offset_y, initial_offset_x, offset_x, offset_y, rows, columns, hysteresis_offset):
+    """Calculate the setpoints of a well plate in a serpentine visit order
 
     Args:
         initial_offset_x: initial offset from corner to well center a1 -- for now this is hardcoded in globals.py, leave at 0
@@ -11,25 +11,37 @@ def generate_setpoints(initial_offset_y, initial_offset_x, offset_x, offset_y, r
         offset_y: distance between wells in y direction
         rows: number of wells in y direction
         columns: number of wells in x direction
+        hysteresis_offset: offset added to the x setpoints to compensate the hysteresis when moving in reverse
+
+    Returns:
+        list of (x setpoint, y setpoint) tuples in the order they should be visited
     """
+    setpoints = []
+    for y in range(rows):
+        row_buffer = []
+        for x in range(columns):
+            # Compensate hysteresis on x axis by changing the setpoints
+            if y % 2 != 0 and x != columns - 1:
+                setpoint_x = round(initial_offset_x + x * offset_x + hysteresis_offset, 2)
+            elif y % 2 == 0 and (x == 0 and y != 0):
+                setpoint_x = round(initial_offset_x + x * offset_x + hysteresis_offset, 2)
+            else:
+                setpoint_x = round(initial_offset_x + x * offset_x, 2)
+            setpoint_y = round(initial_offset_y + y * offset_y, 2)
+            row_buffer.append((setpoint_x, setpoint_y))
+        if y % 2 != 0:
+            row_buffer.reverse()
+        setpoints.extend(row_buffer)
+    return setpoints
 
+
+def generate_setpoints(initial_offset_y, initial_offset_x, offset_x, offset_y, rows, columns, hysteresis_offset):
+    """Write setpoints to testsetpoints.csv, see compute_setpoints for the arguments"""
+    setpoints = compute_setpoints(initial_offset_y, initial_offset_x, offset_x, offset_y, rows, columns,
+                                  hysteresis_offset)
     with open('testsetpoints.csv', 'w') as f:
-        for y in range(rows):
-            lines_buffer = []
-            for x in range(columns):
-                # Compensate hysteresis on x axis by changing the setpoints
-                if y % 2 != 0 and x != columns - 1:
-                    setpoint_x = round(initial_offset_x + x * offset_x + hysteresis_offset, 2)
-                elif y % 2 == 0 and (x == 0 and y != 0):
-                    setpoint_x = round(initial_offset_x + x * offset_x + hysteresis_offset, 2)
-                else:
-                    setpoint_x = round(initial_offset_x + x * offset_x, 2)
-                setpoint_y = round(initial_offset_y + y * offset_y, 2)
-                lines_buffer.append("{}, {}\n".format(setpoint_x, setpoint_y))
-            if y % 2 != 0:
-                lines_buffer.reverse()
-            for line in lines_buffer:
-                f.write(line)
+        for setpoint_x, setpoint_y in setpoints:
+            f.write("{}, {}\n".format(setpoint_x, setpoint_y))
 
 
 if __name__ == '__main__':
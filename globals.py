@@ -1,18 +1,20 @@
-from caliper import Caliper
-from controller import Controller
-from steppermotor import StepperMotor
-from camera import Camera
-import RPi.GPIO as GPIO
-import threading
+from plate_library import PlateLibrary, PlateGeometry, SetpointsFile
 
 # The options that appear in the gui in the well plate choice drop down menu
-# The dict value should be the path to a setpoints file (see testsetpoints.csv for an example)
-# Setting the path to None will prompt the user to choose and open a file
+# The dict value should be a PlateGeometry, a SetpointsFile or the path to a setpoints file
+# (see testsetpoints.csv for an example)
+# Setting the value to None will prompt the user to choose and open a file
+# A PlateGeometry is only used for plates of which the position of A1 relative to the calibrated setpoint offsets is
+# measured on the instrument, other plates use the setpoints measured for them.
+# Setting well_diameter photographs multiple wells at once if they fit in the camera field of view,
+# the diameters of the 12 and 48 well plates are the nominal diameters of standard plates.
 DROPDOWN_OPTIONS_DICT = {'Kies .csv bestand': None,
-                         '12': '/setpoints/wellplate_12.csv',
+                         '12': SetpointsFile('/setpoints/wellplate_12.csv', well_diameter=22.1),
                          '36': '/setpoints/wellplate_36.csv',
-                         '48': '/setpoints/wellplate_48.csv',
-                         '96': 'D:\Libraries\Documents\pycharmprojects\\automated-microplate-reader\\testsetpoints.csv'}
+                         '48': SetpointsFile('/setpoints/wellplate_48.csv', well_diameter=10.9),
+                         '96': PlateGeometry(pitch_x=9, pitch_y=9, rows=8, columns=12, hysteresis_offset=2.5)}
+# Set the hysteresis_offset of the plates to 0 once a backlash profile is made with backlash.py,
+# the controllers then compensate the backlash themselves.
 
 # Constants/Settings
 # See the class implementations for an explanation of the available parameters
@@ -33,7 +35,11 @@ CONTROLLER_X_D_GAIN = 0
 CONTROLLER_X_FREQ_LIMITS = [10, 800]  # Hz
 CONTROLLER_X_ERROR_MARGIN = 0.1  # mm
 CONTROLLER_X_SETTLING_TIME = 0.3  # s
+CONTROLLER_X_MAX_REJECTED_READINGS = 3  # consecutive readings rejected by the median filter before stopping
 CONTROLLER_X_SETPOINT_OFFSET = 7 + 12  # mm
+# mm, setpoints that can be reached without hitting the limit switches.
+# Not measured yet: set them to the travel of the axis between the limit switches minus the setpoint offset.
+CONTROLLER_X_SETPOINT_LIMITS = [0, 110]
 
 CALIPER_Y_PIN_DATA = 20
 CALIPER_Y_PIN_CLOCK = 21
@@ -51,7 +57,9 @@ CONTROLLER_Y_D_GAIN = 0
 CONTROLLER_Y_FREQ_LIMITS = [10, 800]
 CONTROLLER_Y_ERROR_MARGIN = 0.1
 CONTROLLER_Y_SETTLING_TIME = 0.3
+CONTROLLER_Y_MAX_REJECTED_READINGS = 3
 CONTROLLER_Y_SETPOINT_OFFSET = 0 + 6
+CONTROLLER_Y_SETPOINT_LIMITS = [0, 80]  # Not measured yet, see CONTROLLER_X_SETPOINT_LIMITS
 
 STEPPERMOTOR_Z_PIN_STEP = 22
 STEPPERMOTOR_Z_PIN_DIRECTION = 27
@@ -61,6 +69,68 @@ STEPPERMOTOR_Z_FREQUENCY_DEFAULT = 25
 
 EMERGENCY_STOP_BUTTON_PIN = 23
 
+# Area of the well plate visible in a full resolution photo
+CAMERA_FOV_WIDTH = 36  # mm
+CAMERA_FOV_HEIGHT = 27  # mm
+CAMERA_CROP_MARGIN = 1  # mm of extra space around each well when cropping multi well photos
+CAMERA_SENSOR_RESOLUTION = (3280, 2464)  # px, camera module v2
+CAMERA_IMAGE_AXIS_SIGNS = (1, 1)  # Set to -1 if the image x or y axis points in the opposite direction of the axis
+
+# Capture profile of every run, see capture_profile.py.
+# Plates photographed one well at a time are zoomed in on the well, so photos are smaller and faster to save.
+CAPTURE_PIXELS_PER_MM = 40  # The default 1280x720 photo of the full field of view was ~35 px/mm
+CAPTURE_FORMAT = 'jpeg'  # 'jpeg' or 'png'
+CAPTURE_QUALITY = 85  # jpeg quality 1-100
+CAPTURE_GRAYSCALE = False
+
+# Every photo is checked on a downscaled copy, see frame_quality.py.
+# Positions with a failing photo are photographed again later in the same run, where it adds the least travel.
+# Off by default: the thresholds are conservative starting points that have to be checked against photos of the
+# plates in use, a false rejection costs a move and a photo for every recapture.
+QUALITY_CHECK_ENABLED = False
+# Variance of the laplacian of the 256 px gray thumbnail. Sensor noise alone gives about 1-2,
+# a well with any focused edge gives well over 20.
+QUALITY_MIN_SHARPNESS = 5.0
+# Gray level of the brightest percent of the pixels. Even a black walled plate has a lit well bottom far above this,
+# below it the light is off or the exposure failed.
+QUALITY_MIN_HIGHLIGHT = 40
+# Fraction of pixels that may be clipped white, specular reflections on the well rims stay below a few percent
+QUALITY_MAX_CLIPPED_FRACTION = 0.05
+# 0 for the same fine detail along x and y, 0.75 for detail smeared over 4 px or more in one direction.
+# A still scene with directional detail stays near 0, half of the maximum leaves room for noise.
+QUALITY_MAX_MOTION_BLUR = 0.4
+QUALITY_MAX_RECAPTURES = 2  # After this many recaptures the last photo is kept
+
+# Settle on the camera image instead of the fixed controller settling time, see motion_settle.py.
+# A move ends as soon as the position is within the error band and the camera image is stable.
+IMAGE_SETTLE_ENABLED = False
+IMAGE_SETTLE_FRAME_WIDTH = 160  # px, the height follows the aspect ratio of the field of view
+IMAGE_SETTLE_MAX_DIFFERENCE = 2.0  # Mean absolute difference between frames in gray levels
+IMAGE_SETTLE_STABLE_FRAMES = 3  # Consecutive stable frame differences
+# s, maximum wait for a stable image within the error band, after which the fixed settling time is used
+IMAGE_SETTLE_TIMEOUT = 2.0
+
+# Store the uncompressed frame of every well in a memory mapped array in frames/, see frame_stack.py.
+# Reanalysis can read any well or channel from it without decoding the photos.
+FRAME_STACK_ENABLED = False
+
+# Vision based fine positioning, only used for plates with a well diameter that are photographed one well at a time.
+# The controllers stop as soon as they are within the coarse band, then the well is located in a low resolution frame.
+# If the well centre is close enough the photo is cropped to it, otherwise one corrective move is made.
+VISION_POSITIONING_ENABLED = False
+VISION_COARSE_BAND = 0.5  # mm
+VISION_FRAME_WIDTH = 320  # px, the height follows the aspect ratio of the field of view
+VISION_ACCEPT_RADIUS = 1.5  # mm, maximum offset of the well centre that is fixed by cropping instead of moving
+
+# Record the position, step frequency and direction of every controller move to logs/, used by backlash.py
+CAPTURE_CONTROLLER_DATA = False
+
+# Record the raw caliper clock edges of every run to logs/, these can be replayed with caliper_log.py
+CALIPER_RECORDING_ENABLED = False
+
+# Local port of the engine control server when running with --headless, see server.py
+ENGINE_SERVER_PORT = 8765
+
 # The time to ignore interrupts for after leaving the calibrated zero position for the first time.
 INTERRUPT_IGNORE_TIME = 1.5  # s
 
@@ -72,17 +142,28 @@ steppermotor_z = None
 # Global reference to camera object
 camera = None
 
+# Global reference to the plate library with the compiled DROPDOWN_OPTIONS_DICT plates
+plate_library = None
+
 # Global reference to tkinter app frame object
 app = None
 
-# Set to stop process while it's running.
-stop_process_event = threading.Event()
-# Set to pause process while it's running after it finishes the current photo, clear to continue the process.
-pause_process_event = threading.Event()
+# Global reference to the headless run engine
+engine = None
 
 
 def initialise_io():
-    """Initialise all IO pins and global object references (except gui)"""
+    """Initialise all IO pins and global object references (except gui)
+    The hardware modules are imported here instead of at the top, so importing globals stays fast and has no side
+    effects. The camera is opened in the background, see Camera."""
+    from caliper import Caliper
+    from controller import Controller
+    from steppermotor import StepperMotor
+    from camera import Camera
+    from backlash import load_backlash
+    from autotune import load_axis_profile
+    import RPi.GPIO as GPIO
+    from gpio_events import dispatcher, PRIORITY_SAFETY
     global controller_x, controller_y, steppermotor_z, camera
     # create x-axis controller object
     caliper_x = Caliper(CALIPER_X_PIN_DATA,
@@ -98,17 +179,21 @@ def initialise_io():
                                   STEPPERMOTOR_X_FREQUENCY_DEFAULT,
                                   calibration_timeout=60,
                                   name="x")
-    controller_x = Controller(CONTROLLER_X_P_GAIN,
-                              CONTROLLER_X_I_GAIN,
-                              CONTROLLER_X_D_GAIN,
+    # Settings tuned with autotune.py replace the constants above
+    profile_x = load_axis_profile("x")
+    controller_x = Controller(profile_x.get('p_gain', CONTROLLER_X_P_GAIN),
+                              profile_x.get('i_gain', CONTROLLER_X_I_GAIN),
+                              profile_x.get('d_gain', CONTROLLER_X_D_GAIN),
                               steppermotor_x,
                               caliper_x,
-                              CONTROLLER_X_ERROR_MARGIN,
-                              CONTROLLER_X_FREQ_LIMITS,
+                              profile_x.get('error_margin', CONTROLLER_X_ERROR_MARGIN),
+                              profile_x.get('frequency_limits', CONTROLLER_X_FREQ_LIMITS),
                               CONTROLLER_X_SETTLING_TIME,
                               "x",
                               CONTROLLER_X_SETPOINT_OFFSET,
-                              INTERRUPT_IGNORE_TIME)
+                              INTERRUPT_IGNORE_TIME,
+                              load_backlash("x"),
+                              CONTROLLER_X_MAX_REJECTED_READINGS)
 
     # create y-axis controller object
     caliper_y = Caliper(CALIPER_Y_PIN_DATA,
@@ -124,17 +209,21 @@ def initialise_io():
                                   STEPPERMOTOR_Y_FREQUENCY_DEFAULT,
                                   calibration_timeout=60,
                                   name="y")
-    controller_y = Controller(CONTROLLER_Y_P_GAIN,
-                              CONTROLLER_Y_I_GAIN,
-                              CONTROLLER_Y_D_GAIN,
+    # Settings tuned with autotune.py replace the constants above
+    profile_y = load_axis_profile("y")
+    controller_y = Controller(profile_y.get('p_gain', CONTROLLER_Y_P_GAIN),
+                              profile_y.get('i_gain', CONTROLLER_Y_I_GAIN),
+                              profile_y.get('d_gain', CONTROLLER_Y_D_GAIN),
                               steppermotor_y,
                               caliper_y,
-                              CONTROLLER_Y_ERROR_MARGIN,
-                              CONTROLLER_Y_FREQ_LIMITS,
+                              profile_y.get('error_margin', CONTROLLER_Y_ERROR_MARGIN),
+                              profile_y.get('frequency_limits', CONTROLLER_Y_FREQ_LIMITS),
                               CONTROLLER_Y_SETTLING_TIME,
                               "y",
                               CONTROLLER_Y_SETPOINT_OFFSET,
-                              INTERRUPT_IGNORE_TIME)
+                              INTERRUPT_IGNORE_TIME,
+                              load_backlash("y"),
+                              CONTROLLER_Y_MAX_REJECTED_READINGS)
 
     # create z-axis steppermotor object
     steppermotor_z = StepperMotor(STEPPERMOTOR_Z_PIN_STEP,
@@ -149,12 +238,35 @@ def initialise_io():
     camera = Camera()
 
     # setup emergency stop button interrupt
-    from main import stop_process
     GPIO.setmode(GPIO.BCM)
     emergency_stop_pin = EMERGENCY_STOP_BUTTON_PIN
     GPIO.setwarnings(False)
     GPIO.setup(emergency_stop_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    GPIO.add_event_detect(emergency_stop_pin, GPIO.FALLING, callback=stop_process)
+    dispatcher.add_handler(emergency_stop_pin, GPIO.FALLING, emergency_stop, priority=PRIORITY_SAFETY)
+
+
+def emergency_stop(event):
+    """Emergency stop button interrupt handler, stops the running process"""
+    if engine is not None:
+        engine.call(engine.stop())
+
+
+def initialise_plate_library():
+    """Compile and validate all well plates in DROPDOWN_OPTIONS_DICT"""
+    global plate_library
+    plate_library = PlateLibrary(CONTROLLER_X_SETPOINT_LIMITS, CONTROLLER_Y_SETPOINT_LIMITS,
+                                 CAMERA_FOV_WIDTH, CAMERA_FOV_HEIGHT, CAMERA_CROP_MARGIN, CAMERA_IMAGE_AXIS_SIGNS)
+    for name, source in DROPDOWN_OPTIONS_DICT.items():
+        if source is not None:
+            plate_library.add(name, source)
+
+
+def initialise_engine():
+    """Create and start the headless run engine, call after initialise_io and initialise_plate_library"""
+    from engine import RunEngine  # Avoiding circular imports
+    global engine
+    engine = RunEngine(controller_x, controller_y, camera, plate_library)
+    engine.start()
 
 
 def initialise_gui():
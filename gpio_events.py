@@ -0,0 +1,94 @@
+from collections import namedtuple
+import itertools
+import queue
+import threading
+import time
+import RPi.GPIO as GPIO
+
+# A single edge on a GPIO input
+# channel: BCM pin number
+# timestamp: time.time() taken in the interrupt callback, before any handler ran
+# edge: GPIO.RISING, GPIO.FALLING or GPIO.BOTH as registered
+EdgeEvent = namedtuple('EdgeEvent', ['channel', 'timestamp', 'edge'])
+
+# Handler priorities, lower numbers are handled first
+PRIORITY_SAFETY = 0  # Emergency stop and limit switches
+PRIORITY_NORMAL = 1
+
+
+class GpioEventDispatcher:
+    def __init__(self):
+        """Central dispatcher for GPIO edge interrupts.
+        RPi.GPIO calls all interrupt callbacks from a single thread, so a slow callback delays every other edge,
+        including the caliper clock edges that have to be sampled immediately.
+        Edges are timestamped in the interrupt callback and then either:
+        - handled inline, only for fast handlers that have to sample a pin on the edge (caliper clock), or
+        - queued for a worker thread that runs the handlers in priority order, safety events first.
+        Debouncing delays the queued event with a timer instead of sleeping in the interrupt callback.
+        """
+        self.event_queue = queue.PriorityQueue()
+        self.sequence = itertools.count()  # Keeps events with the same priority in order
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def add_fast_handler(self, channel, edge, handler):
+        """Register a handler that runs inline in the interrupt callback.
+        Only use this for handlers that have to run on the edge and never block.
+
+        Args:
+            channel: BCM pin number
+            edge: GPIO.RISING, GPIO.FALLING or GPIO.BOTH
+            handler: callable taking an EdgeEvent
+        """
+        def callback(callback_channel):
+            handler(EdgeEvent(callback_channel, time.time(), edge))
+
+        GPIO.add_event_detect(channel, edge, callback=callback)
+
+    def add_handler(self, channel, edge, handler, priority=PRIORITY_NORMAL, debounce=None, bouncetime=None):
+        """Register a handler that runs in the dispatcher worker thread.
+
+        Args:
+            channel: BCM pin number
+            edge: GPIO.RISING, GPIO.FALLING or GPIO.BOTH
+            handler: callable taking an EdgeEvent
+            priority: PRIORITY_SAFETY or PRIORITY_NORMAL
+            debounce: optional time in seconds to wait before handling the event,
+                      so the handler can check the pin is still in the same state
+            bouncetime: optional RPi.GPIO bouncetime in ms
+        """
+        def callback(callback_channel):
+            event = EdgeEvent(callback_channel, time.time(), edge)
+            if debounce:
+                threading.Timer(debounce, self._queue_event, args=[priority, event, handler]).start()
+            else:
+                self._queue_event(priority, event, handler)
+
+        if bouncetime is None:
+            GPIO.add_event_detect(channel, edge, callback=callback)
+        else:
+            GPIO.add_event_detect(channel, edge, callback=callback, bouncetime=bouncetime)
+        self._start_worker()
+
+    def _queue_event(self, priority, event, handler):
+        self.event_queue.put((priority, next(self.sequence), event, handler))
+
+    def _start_worker(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+    def _run(self):
+        """Worker thread, handles the queued events in priority order"""
+        while True:
+            _, _, event, handler = self.event_queue.get()
+            try:
+                handler(event)
+            except Exception as e:
+                # A failing handler should not stop the other handlers
+                print("GPIO event handler for channel {} failed: {!r}".format(event.channel, e))
+
+
+# Dispatcher shared by all GPIO users
+dispatcher = GpioEventDispatcher()
@@ -1,16 +1,25 @@
 import tkinter as tk
-from main import start_process, stop_process, pause_process, z_move_camera
 from PIL import ImageTk, Image
-import threading
-from globals import DROPDOWN_OPTIONS_DICT
+import os
+import queue
+from tkinter import filedialog, messagebox
+from globals import DROPDOWN_OPTIONS_DICT, CAPTURE_CONTROLLER_DATA
 
 
 class AutomatedMicroplateReaderApplication(tk.Frame):
     def __init__(self, master):
-        """Tkinter frame for the automated microplate reader user interface"""
+        """Tkinter frame for the automated microplate reader user interface.
+        The gui is a client of the run engine: buttons call the engine API and the engine events update the screen."""
         super().__init__(master)
         self.grid()
 
+        # Engine events are emitted from other threads, they are handed to the tkinter thread through this queue
+        from globals import engine
+        self.engine = engine
+        self.event_queue = queue.Queue()
+        self.paused = False
+        self.engine.add_listener(self._engine_event)
+
         # Register entry validation function that only allows positive integers
         self.check_num_zsteps = (self.register(self.validate_int), '%P')
 
@@ -18,6 +27,7 @@ class AutomatedMicroplateReaderApplication(tk.Frame):
 
         # Set initial status text
         self.update_status('STANDBY')
+        self.process_engine_events()
 
     def create_widgets(self):
         # Well plate choice drop down
@@ -30,11 +40,14 @@ class AutomatedMicroplateReaderApplication(tk.Frame):
         self.button_start = tk.Button(self, text='Start', command=self._start_pressed)
         self.button_start.grid(row=2, column=0)
         # Pause button
-        self.button_pause = tk.Button(self, text='Pauze', command=pause_process)
+        self.button_pause = tk.Button(self, text='Pauze', command=self._pause_pressed)
         self.button_pause.grid(row=2, column=1)
         # Stop button
-        self.button_stop = tk.Button(self, text='Stop', command=stop_process)
+        self.button_stop = tk.Button(self, text='Stop', command=lambda: self.engine.call(self.engine.stop()))
         self.button_stop.grid(row=2, column=2)
+        # Resume button
+        self.button_resume = tk.Button(self, text='Hervatten', command=self._resume_pressed)
+        self.button_resume.grid(row=1, column=2)
         # Status labels
         self.label_statustext = tk.Label(self, text='Status: ')
         self.label_statustext.grid(row=0, column=0)
@@ -56,15 +69,69 @@ class AutomatedMicroplateReaderApplication(tk.Frame):
                                          validate='key', validatecommand=self.check_num_zsteps)
         self.entry_num_zsteps.grid(row=4, column=1)
         self.button_z_up = tk.Button(self, text='Omhoog',
-                                     command=lambda: z_move_camera(int(self.stringvar_num_zsteps.get())))
+                                     command=lambda: self._move_z(int(self.stringvar_num_zsteps.get())))
         self.button_z_up.grid(row=5, column=0)
         self.button_z_down = tk.Button(self, text='Omlaag',
-                                       command=lambda: z_move_camera(-int(self.stringvar_num_zsteps.get())))
+                                       command=lambda: self._move_z(-int(self.stringvar_num_zsteps.get())))
         self.button_z_down.grid(row=5, column=1)
 
+    def _move_z(self, num_steps):
+        """Move the camera on the z-axis by a given number of steps, a negative number moves it down"""
+        from globals import steppermotor_z
+        steppermotor_z.move_steps(num_steps)
+
     def _start_pressed(self):
-        """Called when the start button is pressed. start_process is called in it's own thread to not block the gui"""
-        threading.Thread(target=start_process, args=[DROPDOWN_OPTIONS_DICT[self.stringvar_well_plate.get()]]).start()
+        """Called when the start button is pressed. Submits the chosen well plate to the engine"""
+        well_plate = self.stringvar_well_plate.get()
+        if DROPDOWN_OPTIONS_DICT[well_plate] is not None:
+            self._call_engine(self.engine.submit(well_plate, capture_data=CAPTURE_CONTROLLER_DATA))
+        else:
+            setpoints_path = filedialog.askopenfilename(filetypes=[('Setpoints csv', '*.csv')])
+            if setpoints_path:
+                self._call_engine(self.engine.submit(setpoints_path=setpoints_path,
+                                                     capture_data=CAPTURE_CONTROLLER_DATA))
+
+    def _resume_pressed(self):
+        """Called when the resume button is pressed. Resumes the last interrupted run"""
+        self._call_engine(self.engine.submit(resume=True, capture_data=CAPTURE_CONTROLLER_DATA))
+
+    def _pause_pressed(self):
+        """Called when the pause button is pressed. Pauses or continues the run"""
+        if self.paused:
+            self._call_engine(self.engine.unpause())
+        else:
+            self._call_engine(self.engine.pause())
+
+    def _call_engine(self, coroutine):
+        """Call the engine API without blocking the gui, errors are shown as engine error events"""
+        def done(future):
+            if future.exception() is not None:
+                self.event_queue.put({'type': 'error', 'message': str(future.exception())})
+        self.engine.call(coroutine).add_done_callback(done)
+
+    def _engine_event(self, event):
+        """Engine listener, called from the engine threads"""
+        self.event_queue.put(event)
+
+    def process_engine_events(self):
+        """Handle the queued engine events in the tkinter thread, reschedules itself"""
+        while True:
+            try:
+                event = self.event_queue.get_nowait()
+            except queue.Empty:
+                break
+            if event['type'] == 'status':
+                self.update_status(event['text'])
+            elif event['type'] == 'well_done' and os.path.exists(event['photo']):
+                # Show the image on screen
+                self.update_image(event['photo'])
+            elif event['type'] == 'paused':
+                self.paused = True
+            elif event['type'] in ('unpaused', 'run_finished'):
+                self.paused = False
+            elif event['type'] == 'error':
+                messagebox.showerror('Foutmelding', event['message'])
+        self.after(50, self.process_engine_events)
 
     def update_image(self, image_path):
         """
@@ -0,0 +1,72 @@
+import time
+import numpy as np
+
+# Time in seconds between checks whether the load entered the error band, no frames are grabbed before it did
+BAND_POLL_INTERVAL = 0.01
+
+
+def frame_difference(previous, frame):
+    """Mean absolute difference between two gray frames, in gray levels"""
+    return float(np.abs(frame - previous).mean())
+
+
+def monitor_stability(frames, stable_event, finished_event, in_band, max_difference, stable_frames, timeout,
+                      fall_back):
+    """Watch a stream of frames and keep stable_event set while the image is stable.
+    The image is stable when the difference between the last stable_frames consecutive frames is below
+    max_difference. A vibrating plate or gantry shifts the image between frames, sensor noise alone does not.
+    Frames are only grabbed while the load is within the error band, to leave the cpu to the caliper decoding
+    during the rest of the move. Runs until finished_event is set, so call it from its own thread.
+
+    If the image does not become stable within timeout seconds after the load entered the error band, or there are no
+    frames, for example because no camera is connected, fall_back is called and monitoring stops.
+    The move then ends on the fixed settling time of the controllers, never on an image that was not seen to be stable.
+
+    Args:
+        frames: iterable of numpy arrays with shape (height, width, 3), see Camera.stream_frames
+        stable_event: threading.Event, set while the image is stable
+        finished_event: threading.Event, set by the caller to stop monitoring
+        in_band: callable returning True while the load is within the error band, see Controller.settling
+        max_difference: maximum mean absolute difference between frames in gray levels
+        stable_frames: number of consecutive stable frame differences needed
+        timeout: maximum time in seconds to wait for a stable image in the error band
+        fall_back: callable to settle on the fixed settling time instead
+    """
+    previous = None
+    stable_count = 0
+    band_time = None  # Time the load entered the error band, None while outside of it
+    frames = iter(frames)
+    while not finished_event.is_set():
+        if not in_band():
+            # The load is outside the error band or the run is paused, wait for a stable image once it is in the band
+            band_time = None
+            previous = None
+            stable_count = 0
+            stable_event.clear()
+            finished_event.wait(BAND_POLL_INTERVAL)
+            continue
+        if band_time is None:
+            band_time = time.time()
+        if time.time() - band_time > timeout:
+            stable_event.clear()
+            fall_back()
+            break
+        frame = next(frames, None)
+        if frame is None:
+            # No camera connected
+            fall_back()
+            break
+        gray = frame.mean(axis=2, dtype=np.float32)
+        if previous is not None:
+            if frame_difference(previous, gray) < max_difference:
+                stable_count += 1
+            else:
+                stable_count = 0
+            if stable_count >= stable_frames:
+                stable_event.set()
+            else:
+                stable_event.clear()
+        previous = gray
+    if hasattr(frames, 'close'):
+        # Release the video port before the photo is taken
+        frames.close()
@@ -10,3 +10,7 @@ class PiCamera:
 
     def capture(self, *args, **kwargs):
         pass
+
+    def capture_continuous(self, output, *args, **kwargs):
+        while True:
+            yield output
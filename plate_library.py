@@ -0,0 +1,167 @@
+from collections import namedtuple
+import csv
+import hashlib
+import json
+import math
+from capture_planner import plan_captures, single_well_plan
+from generate_setpoints import compute_setpoints
+
+# Well plate geometry, all distances in mm. See generate_setpoints.compute_setpoints for the meaning of the fields.
+# well_diameter is optional, when given multiple wells are photographed at once if they fit in the field of view.
+PlateGeometry = namedtuple('PlateGeometry', ['pitch_x', 'pitch_y', 'rows', 'columns', 'offset_x', 'offset_y',
+                                             'hysteresis_offset', 'well_diameter'])
+PlateGeometry.__new__.__defaults__ = (0, 0, 0, None)
+
+# A setpoints csv file of a plate with known well diameter, so multiple wells can be photographed at once
+# path: filepath of the csv file, see read_setpoints_csv
+# well_diameter: well diameter in mm or None to photograph every well separately
+SetpointsFile = namedtuple('SetpointsFile', ['path', 'well_diameter'])
+SetpointsFile.__new__.__defaults__ = (None,)
+
+# A validated layout that is ready to run
+# key: content hash of the setpoints and capture settings
+# setpoints: tuple of (x, y) well setpoints in mm in the order they are visited
+# well_diameter: well diameter in mm or None
+# captures: the camera positions to visit, see capture_planner.CapturePosition
+CompiledLayout = namedtuple('CompiledLayout', ['key', 'setpoints', 'well_diameter', 'captures'])
+
+
+class LayoutError(ValueError):
+    pass
+
+
+def read_setpoints_csv(filepath):
+    """Read setpoints from a csv file with 2 columns (x setpoint, y setpoint per well)
+
+    Raises:
+        LayoutError: if the file can not be read or a row is malformed
+    """
+    setpoints = []
+    try:
+        with open(filepath) as f:
+            for row_number, row in enumerate(csv.reader(f), 1):
+                if not row:
+                    continue
+                try:
+                    setpoint_x, setpoint_y = map(float, row)
+                except ValueError:
+                    raise LayoutError("{} regel {}: ongeldige setpoints {}".format(filepath, row_number, row))
+                setpoints.append((setpoint_x, setpoint_y))
+    except OSError:
+        raise LayoutError("{} is geen geldig bestand".format(filepath))
+    return setpoints
+
+
+def validate_setpoints(setpoints, x_limits, y_limits):
+    """Check that every setpoint is a finite number within the travel limits of the axes
+
+    Args:
+        setpoints: list of (x, y) setpoints in mm
+        x_limits: (minimum, maximum) allowed x setpoint in mm
+        y_limits: (minimum, maximum) allowed y setpoint in mm
+
+    Raises:
+        LayoutError: if a setpoint is invalid
+    """
+    if not setpoints:
+        raise LayoutError("Geen setpoints")
+    for number, (setpoint_x, setpoint_y) in enumerate(setpoints, 1):
+        if not (math.isfinite(setpoint_x) and math.isfinite(setpoint_y)):
+            raise LayoutError("Well {}: ongeldige setpoint ({}, {})".format(number, setpoint_x, setpoint_y))
+        if not x_limits[0] <= setpoint_x <= x_limits[1] or not y_limits[0] <= setpoint_y <= y_limits[1]:
+            raise LayoutError("Well {}: setpoint ({}, {}) valt buiten het bereik van de assen"
+                              .format(number, setpoint_x, setpoint_y))
+
+
+class PlateLibrary:
+    def __init__(self, x_limits, y_limits, fov_width, fov_height, crop_margin, image_axis_signs=(1, 1)):
+        """Compiles well plate layouts into validated setpoints and capture plans and caches them.
+        Layouts are compiled once, so starting a run is a dict lookup and bad layouts are rejected before homing.
+
+        Args:
+            x_limits: (minimum, maximum) allowed x setpoint in mm
+            y_limits: (minimum, maximum) allowed y setpoint in mm
+            fov_width: width of the camera field of view in mm
+            fov_height: height of the camera field of view in mm
+            crop_margin: extra space in mm around each well when cropping multi well photos
+            image_axis_signs: orientation of the camera image axes, see capture_planner.plan_captures
+        """
+        self.x_limits = x_limits
+        self.y_limits = y_limits
+        self.fov_width = fov_width
+        self.fov_height = fov_height
+        self.crop_margin = crop_margin
+        self.image_axis_signs = tuple(image_axis_signs)
+        self.compiled = {}  # Content hash to CompiledLayout
+        self.plates = {}  # Plate name to CompiledLayout or the LayoutError raised while compiling it
+
+    def compile_setpoints(self, setpoints, well_diameter=None):
+        """Validate setpoints and plan the camera positions, or return the cached result for the same content
+
+        Args:
+            setpoints: list of (x, y) setpoints in mm in the order they are visited
+            well_diameter: well diameter in mm or None to photograph every well separately
+
+        Returns:
+            CompiledLayout
+
+        Raises:
+            LayoutError: if the setpoints are invalid
+        """
+        setpoints = tuple((float(x), float(y)) for x, y in setpoints)
+        content = json.dumps([setpoints, well_diameter, self.fov_width, self.fov_height, self.crop_margin,
+                              self.image_axis_signs])
+        key = hashlib.sha1(content.encode()).hexdigest()
+        if key in self.compiled:
+            return self.compiled[key]
+
+        validate_setpoints(setpoints, self.x_limits, self.y_limits)
+        if well_diameter is None:
+            captures = single_well_plan(setpoints)
+        else:
+            captures = plan_captures(setpoints, well_diameter, self.fov_width, self.fov_height, self.crop_margin,
+                                     self.image_axis_signs)
+        layout = CompiledLayout(key, setpoints, well_diameter, tuple(captures))
+        self.compiled[key] = layout
+        return layout
+
+    def compile_geometry(self, geometry):
+        """Generate, validate and compile the setpoints of a PlateGeometry"""
+        if geometry.rows <= 0 or geometry.columns <= 0:
+            raise LayoutError("Een well plate heeft minstens 1 rij en 1 kolom")
+        setpoints = compute_setpoints(geometry.offset_y, geometry.offset_x, geometry.pitch_x, geometry.pitch_y,
+                                      geometry.rows, geometry.columns, geometry.hysteresis_offset)
+        return self.compile_setpoints(setpoints, geometry.well_diameter)
+
+    def compile_csv(self, filepath, well_diameter=None):
+        """Read, validate and compile the setpoints in a csv file"""
+        return self.compile_setpoints(read_setpoints_csv(filepath), well_diameter)
+
+    def add(self, name, source):
+        """Compile a plate and store it under a name. Errors are stored and raised by get.
+
+        Args:
+            name: plate name
+            source: PlateGeometry, SetpointsFile or csv filepath
+        """
+        try:
+            if isinstance(source, PlateGeometry):
+                self.plates[name] = self.compile_geometry(source)
+            elif isinstance(source, SetpointsFile):
+                self.plates[name] = self.compile_csv(source.path, source.well_diameter)
+            else:
+                self.plates[name] = self.compile_csv(source)
+        except LayoutError as e:
+            self.plates[name] = e
+
+    def get(self, name):
+        """Get a compiled plate by name
+
+        Raises:
+            LayoutError: if the plate layout is invalid
+            KeyError: if there is no plate with the given name
+        """
+        layout = self.plates[name]
+        if isinstance(layout, LayoutError):
+            raise layout
+        return layout
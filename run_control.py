@@ -0,0 +1,67 @@
+import threading
+
+
+class RunStopped(Exception):
+    pass
+
+
+class RunControl:
+    def __init__(self):
+        """Cooperative stop and pause of a run.
+        Every run stage (motion, settling, capture, writing) calls checkpoint at its safe points.
+        A checkpoint raises RunStopped after stop, and blocks while the run is paused.
+        Pausing and stopping notify the waiting stages, so a paused run continues as soon as unpause is called.
+        """
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.paused = False
+
+    def reset(self):
+        """Clear stop and pause, call this before starting a run"""
+        with self.condition:
+            self.stopped = False
+            self.paused = False
+
+    def stop(self):
+        """Stop the run at the next checkpoint, also wakes up a paused run"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def pause(self):
+        """Pause the run at the next checkpoint"""
+        with self.condition:
+            self.paused = True
+
+    def unpause(self):
+        """Continue a paused run immediately"""
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def checkpoint(self, on_pause=None, on_unpause=None):
+        """Safe point of a run stage.
+
+        Args:
+            on_pause: optional callable, called before blocking while the run is paused, for example to stop a motor
+            on_unpause: optional callable, called after the run is unpaused
+
+        Raises:
+            RunStopped: if the run is stopped
+        """
+        # Fast path without taking the lock, this is called on every control loop iteration
+        if not self.stopped and not self.paused:
+            return
+        with self.condition:
+            if self.stopped:
+                raise RunStopped()
+            if not self.paused:
+                return
+            if on_pause is not None:
+                on_pause()
+            while self.paused and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                raise RunStopped()
+        if on_unpause is not None:
+            on_unpause()
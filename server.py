@@ -0,0 +1,73 @@
+import asyncio
+import json
+from engine import EngineError
+from plate_library import LayoutError
+
+# Local control server for the RunEngine, so a LIMS or scheduler can drive the reader without a display.
+# The protocol is newline delimited json over TCP. Every request is a json object with a 'command':
+#     {"command": "submit", "plate": "96"}  or  {"command": "submit", "setpoints_path": "...csv"}
+#     {"command": "submit", "resume": true}
+#     {"command": "pause"}, {"command": "unpause"}, {"command": "stop"}
+#     {"command": "subscribe"}
+# and is answered with {"reply": "<command>", "ok": true, ...} or {"reply": "<command>", "ok": false, "error": "..."}.
+# After subscribing, every engine event is pushed to the client as {"event": {...}}.
+
+
+async def handle_client(engine, reader, writer):
+    """Serve a single client connection"""
+    subscriber = None
+    push_task = None
+
+    async def push_events():
+        while True:
+            event = await subscriber.get()
+            writer.write((json.dumps({'event': event}) + '\n').encode())
+            await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = None
+            try:
+                request = json.loads(line)
+                command = request.get('command')
+                reply = {'reply': command, 'ok': True}
+                if command == 'submit':
+                    reply['run_id'] = await engine.submit(request.get('plate'), request.get('setpoints_path'),
+                                                          request.get('resume', False),
+                                                          request.get('capture_data', False))
+                elif command == 'pause':
+                    await engine.pause()
+                elif command == 'unpause':
+                    await engine.unpause()
+                elif command == 'stop':
+                    await engine.stop()
+                elif command == 'subscribe':
+                    if subscriber is None:
+                        subscriber = engine.subscribe()
+                        push_task = asyncio.ensure_future(push_events())
+                else:
+                    reply = {'reply': command, 'ok': False, 'error': 'unknown command'}
+            except (ValueError, AttributeError, KeyError, EngineError, LayoutError) as e:
+                reply = {'reply': command, 'ok': False, 'error': str(e)}
+            except Exception as e:
+                # Never drop the connection on an unexpected error, for example an unreadable setpoints file
+                reply = {'reply': command, 'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+            writer.write((json.dumps(reply) + '\n').encode())
+            await writer.drain()
+    finally:
+        if subscriber is not None:
+            engine.unsubscribe(subscriber)
+            push_task.cancel()
+        writer.close()
+
+
+async def serve(engine, host='127.0.0.1', port=8765):
+    """Start the control server on the event loop of the engine
+
+    Returns:
+        asyncio.Server
+    """
+    return await asyncio.start_server(lambda reader, writer: handle_client(engine, reader, writer), host, port)
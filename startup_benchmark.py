@@ -0,0 +1,115 @@
+# Startup time benchmark for the headless path, run
+#     python startup_benchmark.py
+# It fails (exit code 1) when a budget below is exceeded, or when the headless startup imports a module it should only
+# import when needed (gui, numpy and PIL are slow to import on the raspberry pi and tkinter needs a display).
+# 1. The import time of main, measured with python -X importtime in a fresh interpreter.
+# 2. The time from launching a fresh interpreter until a headless run starts homing the axes.
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Budgets in seconds
+IMPORT_BUDGET = 0.2
+HOMING_BUDGET = 0.5
+
+# Modules the headless startup should not import
+HEADLESS_FORBIDDEN_MODULES = ('tkinter', 'gui', 'numpy', 'PIL')
+
+# Headless startup of main.py, prints the modules imported before the run started as soon as the run starts homing.
+# The modules are listed on run_started, because the run preloads the image modules in the background while homing.
+HEADLESS_STARTUP = """
+import os
+import sys
+import threading
+import main
+main.initialise_io()
+main.initialise_plate_library()
+main.initialise_engine()
+from globals import engine, DROPDOWN_OPTIONS_DICT
+from plate_library import PlateGeometry
+modules = []
+homing = threading.Event()
+
+
+def listener(event):
+    if event['type'] == 'run_started':
+        modules.extend(sys.modules)
+    elif event.get('text') == 'KALIBREREN':
+        homing.set()
+
+
+engine.add_listener(listener)
+engine.call(engine.submit(next(name for name, source in DROPDOWN_OPTIONS_DICT.items()
+                               if isinstance(source, PlateGeometry))))
+homing.wait()
+print(' '.join(modules))
+sys.stdout.flush()
+os._exit(0)
+"""
+
+
+def parse_importtime(output):
+    """Parse the output of python -X importtime
+
+    Returns:
+        dict of module name to cumulative import time in seconds
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def measure_import_time():
+    """Import time of main in seconds and the slowest modules it imports, as a list of (seconds, name)"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=REPOSITORY_DIRECTORY,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = parse_importtime(process.stderr)
+    slowest = sorted(((seconds, name) for name, seconds in times.items() if name != 'main'), reverse=True)[:10]
+    return times['main'], slowest
+
+
+def measure_homing_time():
+    """Time in seconds from launching a fresh interpreter until the first run starts homing, and the imported modules.
+    The run is started in a temporary directory so its checkpoint and logs do not end up in the repository."""
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY_DIRECTORY)
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = time.perf_counter()
+        process = subprocess.run([sys.executable, '-c', HEADLESS_STARTUP], cwd=directory, env=environment,
+                                 stdout=subprocess.PIPE, universal_newlines=True, check=True, timeout=30)
+        homing_time = time.perf_counter() - start_time
+    return homing_time, process.stdout.split()
+
+
+def main():
+    failed = False
+
+    import_time, slowest = measure_import_time()
+    print("import main: {:.3f} s (budget {:.3f} s)".format(import_time, IMPORT_BUDGET))
+    for seconds, name in slowest:
+        print("    {:.3f} s {}".format(seconds, name))
+    if import_time > IMPORT_BUDGET:
+        failed = True
+
+    homing_time, modules = measure_homing_time()
+    print("launch to homing: {:.3f} s (budget {:.3f} s)".format(homing_time, HOMING_BUDGET))
+    if homing_time > HOMING_BUDGET:
+        failed = True
+    forbidden = [name for name in modules if name.split('.')[0] in HEADLESS_FORBIDDEN_MODULES]
+    if forbidden:
+        print("headless startup imported {}".format(', '.join(sorted(forbidden))))
+        failed = True
+
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,11 @@
 import threading
 import time
 import RPi.GPIO as GPIO
-from tkinter import messagebox
+from gpio_events import dispatcher, PRIORITY_SAFETY
+from run_control import RunStopped
+
+# Longest time in seconds between checkpoints while waiting for the motor, see StepperMotor.calibrate
+CHECKPOINT_INTERVAL = 0.05
 
 
 class StepperMotor:
@@ -34,6 +38,8 @@ class StepperMotor:
         self.stop_step_event = threading.Event()  # Set it to stop stepping. Cleared when start stepping.
 
         self.lock_step_frequency = threading.Lock()
+        self.step_count = 0  # Steps made, counted from the pwm frequency and the time the pwm was running
+        self.step_count_time = None  # Time the step count was last updated, None while not stepping
 
         # Setup GPIO
         GPIO.setmode(GPIO.BCM)
@@ -49,10 +55,10 @@ class StepperMotor:
             GPIO.setup(self.pin_safety_microswitch, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
             # Setup microswitch interrupt
-            GPIO.add_event_detect(self.pin_calibration_microswitch, GPIO.RISING, callback=self.microswitch_callback,
-                                  bouncetime=self.microswitch_bouncetime)
-            GPIO.add_event_detect(self.pin_safety_microswitch, GPIO.RISING, callback=self.microswitch_callback,
-                                  bouncetime=self.microswitch_bouncetime)
+            # Filter out interrupts caused by random noise by checking again after 10ms
+            for pin in (self.pin_calibration_microswitch, self.pin_safety_microswitch):
+                dispatcher.add_handler(pin, GPIO.RISING, self.microswitch_callback, priority=PRIORITY_SAFETY,
+                                       debounce=0.01, bouncetime=self.microswitch_bouncetime)
 
     def enable_interrupts(self):
         self.ignore_interrupt = False
@@ -60,6 +66,35 @@ class StepperMotor:
     def disable_interrupts(self):
         self.ignore_interrupt = True
 
+    @property
+    def frequency(self):
+        """Step frequency of the pwm in steps per second"""
+        return self.step_frequency
+
+    @frequency.setter
+    def frequency(self, value):
+        with self.lock_step_frequency:
+            self._count_steps(self.step_count_time is not None)
+            self.step_frequency = value
+            self.step_pwm.ChangeFrequency(value)
+
+    def _count_steps(self, stepping):
+        """Add the steps made since the last update to self.step_count, call with lock_step_frequency held
+
+        Args:
+            stepping: True if the motor steps from now on
+        """
+        now = time.time()
+        if self.step_count_time is not None:
+            self.step_count += self.step_frequency * (now - self.step_count_time)
+        self.step_count_time = now if stepping else None
+
+    def steps_made(self):
+        """The number of steps made since the motor was created, in either direction"""
+        with self.lock_step_frequency:
+            self._count_steps(self.step_count_time is not None)
+            return self.step_count
+
     def start_step(self, count=None):
         """Start stepping
 
@@ -70,21 +105,68 @@ class StepperMotor:
         self.microswitch_hit_event.clear()
         if count is not None:
             # Move a set amount of steps with the default speed if count is given
-            self.step_frequency = self.default_step_frequency
-            threading.Timer(self.step_frequency / count, self.stop_step).start()
-        self.step_pwm.start(50)
+            self.frequency = self.default_step_frequency
+            threading.Timer(count / self.step_frequency, self.stop_step).start()
+        with self.lock_step_frequency:
+            self._count_steps(True)
+            self.step_pwm.start(50)
+
+    def step_burst(self, count, frequency, checkpoint=None):
+        """Make a burst of steps at the given frequency while stepping, then continue at the previous frequency.
+        Blocks until the burst is made or the motor is stopped.
+
+        Args:
+            count: the number of steps to make, approximated by timing the burst like start_step
+            frequency: step frequency of the burst in steps per second
+            checkpoint: optional callable, see _wait_stepping
+
+        Raises:
+            RunStopped: if raised by checkpoint
+        """
+        previous_frequency = self.frequency
+        self.frequency = frequency
+        try:
+            self._wait_stepping(count / frequency, checkpoint)
+        finally:
+            self.frequency = previous_frequency
+
+    def _wait_stepping(self, duration, checkpoint=None):
+        """Wait while the motor steps for the given duration, or until the motor is stopped
+
+        Args:
+            duration: time to step in seconds, the time checkpoint blocks is not counted
+            checkpoint: optional callable called at least every CHECKPOINT_INTERVAL seconds, that blocks while the run
+                        is paused and raises RunStopped when it is stopped, see RunControl.checkpoint
+
+        Returns:
+            True if the motor was stopped before the duration passed
+        """
+        end_time = time.time() + duration
+        while True:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            if self.stop_step_event.wait(remaining if checkpoint is None else min(remaining, CHECKPOINT_INTERVAL)):
+                return True
+            if checkpoint is not None:
+                pause_time = time.time()
+                checkpoint()
+                end_time += time.time() - pause_time
 
     def stop_step(self):
         """Stop stepping"""
         self.stop_step_event.set()
-        self.step_pwm.stop()
-        self.microswitch_hit_event.clear()
+        with self.lock_step_frequency:
+            self._count_steps(False)
+            self.step_pwm.stop()
 
     def set_duty_cycle(self, value):
-        """Set pwm duty cycle"""
-        self.step_pwm.ChangeDutyCycle(value)
+        """Set pwm duty cycle, the motor does not step at a duty cycle of 0"""
+        with self.lock_step_frequency:
+            self._count_steps(value > 0 and not self.stop_step_event.is_set())
+            self.step_pwm.ChangeDutyCycle(value)
 
-    def reverse(self, setting):
+    def reverse(self, setting=None):
         """Reverse motor direction
 
         Args:
@@ -103,9 +185,27 @@ class StepperMotor:
                 GPIO.output(self.pin_direction, GPIO.LOW)
             self.reversed = not self.reversed
 
-    def calibrate(self):
+    def move_steps(self, num_steps):
+        """Move a given number of steps in either direction and block until the move is finished.
+
+        Args:
+            num_steps: The number of steps to move, a negative number will move the motor in reverse direction
+        """
+        self.reverse(num_steps < 0)
+        self.start_step(abs(num_steps))
+        self.stop_step_event.wait()
+
+    def calibrate(self, checkpoint=None):
         """Calibrate motor to zero position.
-        The motor is moved all the way to one side until the microswitch is hit."""
+        The motor is moved all the way to one side until the microswitch is hit.
+
+        Args:
+            checkpoint: optional callable to pause or stop the calibration, see _wait_stepping
+
+        Raises:
+            CalibrationError: if the microswitch is not hit in time or there is no microswitch
+            RunStopped: if the motor or the run is stopped before the microswitch is hit
+        """
         # check if switch is already pressed, if so then don't move -> the motor is already on its zero position
         if GPIO.input(self.pin_calibration_microswitch) == GPIO.HIGH or GPIO.input(
                 self.pin_safety_microswitch) == GPIO.HIGH:
@@ -113,28 +213,34 @@ class StepperMotor:
             return
         if self.pin_calibration_microswitch is not None:
             self.reverse(False)
-            self.step_frequency = self.default_step_frequency
+            self.frequency = self.default_step_frequency
             self.start_step()
-            if self.microswitch_hit_event.wait(self.calibration_timeout):
-                self.step_counter = 0
-            else:
+            try:
+                stopped = self._wait_stepping(self.calibration_timeout, checkpoint)
+            except RunStopped:
+                self.stop_step()
+                raise
+            if not stopped:
                 self.stop_step()
-                messagebox.showerror('FOUT', 'Fout tijdens calibratie: Timeout (kalibreren duurt te lang)')
+                raise CalibrationError('Fout tijdens calibratie: Timeout (kalibreren duurt te lang)')
+            if not self.microswitch_hit_event.is_set():
+                # Stopped by stop_step before the microswitch was hit
+                raise RunStopped()
+            self.step_counter = 0
         else:
-            messagebox.showerror('FOUT',
-                                 'Voor deze motor is geen eindschakelaar ingesteld en er kan niet worden gekalibreert')
+            self.stop_step_event.set()
+            raise CalibrationError('Voor deze motor is geen eindschakelaar ingesteld en er kan niet worden gekalibreert')
 
-    def microswitch_callback(self, channel):
-        """Interrupt callback. This function is called when the microswitch is pressed."""
+    def microswitch_callback(self, event):
+        """Interrupt handler. This function is called 10ms after the microswitch is pressed with a
+        gpio_events.EdgeEvent, the switch is checked again to filter out noise."""
         if self.ignore_interrupt:
             return
-        # Filter out interrupts caused by random noise by checking again after 10ms
-        time.sleep(0.01)
         if GPIO.input(self.pin_calibration_microswitch) == GPIO.HIGH or GPIO.input(
                 self.pin_safety_microswitch) == GPIO.HIGH:
             self.microswitch_hit_event.set()
             self.stop_step()
-            print("interrupt {} {}".format(self.name, channel))
+            print("interrupt {} {}".format(self.name, event.channel))
 
 
 class CalibrationError(BaseException):
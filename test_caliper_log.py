@@ -0,0 +1,82 @@
+# Regression test of the caliper decoder and median filter on a checked in caliper log, run
+#     python -m unittest test_caliper_log
+# testcaliperlog.bin is a synthetic log written by write_test_log, run this file to write it again:
+#     python test_caliper_log.py
+import os
+import tempfile
+import unittest
+from caliper import Caliper
+from caliper_log import CaliperRecorder, read_log, decode_log
+
+TEST_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testcaliperlog.bin')
+
+# Readings in the log, one packet every 100 ms.
+# A reading of 50 mm is a glitch that the median filter rejects (max error 10 mm).
+TEST_LOG_READINGS = [0.0, 1.25, 2.5, -0.5, 50.0, 3.75, 5.0]
+# The log also contains a packet that is cut off after 10 bits before the 5.0 mm packet.
+TRUNCATED_PACKET_BITS = 10
+
+BIT_INTERVAL = 0.0002  # s between clock edges within a packet
+PACKET_INTERVAL = 0.1  # s between packets
+
+
+def packet_bits(reading):
+    """The 24 data bits of a reading in the order they are clocked out: the value in 1/100 mm lsb first,
+    the sign bit (1 is negative) and 3 zero bits"""
+    value = int(round(abs(reading) * 100))
+    bits = [(value >> i) & 1 for i in range(20)]
+    bits.append(1 if reading < 0 else 0)
+    bits.extend([0, 0, 0])
+    return bits
+
+
+def write_test_log(path):
+    """Write the synthetic test log, see TEST_LOG_READINGS"""
+    recorder = CaliperRecorder(path)
+    timestamp = 1.0
+    for reading in TEST_LOG_READINGS:
+        bits = packet_bits(reading)
+        if reading == TEST_LOG_READINGS[-1]:
+            # Truncated packet, the next packet starts after the pause time
+            for bit in bits[:TRUNCATED_PACKET_BITS]:
+                recorder.record(timestamp, bit)
+                timestamp += BIT_INTERVAL
+            timestamp += PACKET_INTERVAL
+        for bit in bits:
+            recorder.record(timestamp, bit)
+            timestamp += BIT_INTERVAL
+        timestamp += PACKET_INTERVAL
+    recorder.close()
+
+
+class CaliperLogTest(unittest.TestCase):
+    def setUp(self):
+        self.caliper = Caliper(0, 1, 2, name="test")
+
+    def test_read_log(self):
+        edges = read_log(TEST_LOG_PATH)
+        self.assertEqual(len(edges), 24 * len(TEST_LOG_READINGS) + TRUNCATED_PACKET_BITS)
+        self.assertEqual(edges[0], (1.0, 0))
+
+    def test_decode_log(self):
+        readings = [reading for _, reading in decode_log(TEST_LOG_PATH, self.caliper)]
+        self.assertEqual(readings, [0.0, 1.25, 2.5, -0.5, None, 3.75, 5.0])
+        self.assertEqual(self.caliper.stats.rejected, 1)
+        self.assertEqual(self.caliper.stats.framing_errors, 1)
+        self.assertEqual(self.caliper.stats.packets, len(TEST_LOG_READINGS))
+
+    def test_decode_is_deterministic(self):
+        first = decode_log(TEST_LOG_PATH, self.caliper)
+        second = decode_log(TEST_LOG_PATH, self.caliper)
+        self.assertEqual(first, second)
+
+    def test_checked_in_log_is_up_to_date(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log.bin')
+            write_test_log(path)
+            with open(path, 'rb') as new, open(TEST_LOG_PATH, 'rb') as checked_in:
+                self.assertEqual(new.read(), checked_in.read())
+
+
+if __name__ == '__main__':
+    write_test_log(TEST_LOG_PATH)
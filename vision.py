@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def locate_well_centre(frame, well_diameter, min_score=2.0):
+    """Locate the centre of a single well in a low resolution frame.
+    The well rim shows up as a ring of strong intensity gradients, so the gradient magnitude of the frame is matched
+    against a ring template with the well diameter (a Hough circle transform with a fixed radius).
+    The matching is done with FFTs, which is fast enough for small frames on the raspberry pi.
+
+    Args:
+        frame: numpy array with shape (height, width) or (height, width, channels)
+        well_diameter: expected well diameter in pixels
+        min_score: minimum ratio between the best match and the average match to accept the result
+
+    Returns:
+        (x, y) well centre in pixels, or None if no well could be found
+    """
+    gray = np.asarray(frame, dtype=np.float32)
+    if gray.ndim == 3:
+        gray = gray.mean(axis=2)
+    gradient_y, gradient_x = np.gradient(gray)
+    magnitude = np.hypot(gradient_x, gradient_y)
+    if not magnitude.any():
+        # Blank frame, for example when no camera is connected
+        return None
+
+    # Ring template centered on the origin, wrapping around the edges so the correlation peak is at the well centre
+    height, width = gray.shape
+    radius = well_diameter / 2
+    yy = np.fft.fftfreq(height, 1 / height)[:, None]
+    xx = np.fft.fftfreq(width, 1 / width)[None, :]
+    ring = (np.abs(np.hypot(xx, yy) - radius) < 1.0).astype(np.float32)
+
+    score = np.fft.irfft2(np.fft.rfft2(magnitude) * np.fft.rfft2(ring), s=gray.shape)
+    peak = np.unravel_index(np.argmax(score), score.shape)
+    mean = score.mean()
+    if mean <= 0 or score[peak] / mean < min_score:
+        return None
+    return float(peak[1]), float(peak[0])
+
+
+def well_offset(frame, well_diameter, fov_width, fov_height, min_score=2.0):
+    """Locate the well in a frame and return its offset from the centre of the frame in mm
+
+    Args:
+        frame: numpy array with shape (height, width) or (height, width, channels)
+        well_diameter: well diameter in mm
+        fov_width: width of the area visible in the frame in mm
+        fov_height: height of the area visible in the frame in mm
+        min_score: see locate_well_centre
+
+    Returns:
+        (x, y) offset in mm, or None if no well could be found
+    """
+    height, width = frame.shape[:2]
+    scale_x = width / fov_width
+    scale_y = height / fov_height
+    centre = locate_well_centre(frame, well_diameter * (scale_x + scale_y) / 2, min_score)
+    if centre is None:
+        return None
+    return (centre[0] - width / 2) / scale_x, (centre[1] - height / 2) / scale_y